@@ -5,34 +5,46 @@
 # github: https://github.com/yangheng95
 # Copyright (C) 2021. All Rights Reserved.
 import os
-import random
+
+import matplotlib
+
+matplotlib.use('Agg')  # the figures are only saved to disk, skip the GUI backend initialization
 
 from metric_visualizer import MetricVisualizer
 import numpy as np
 
-MV = MetricVisualizer(name='example', trial_tag='Trial ID', trial_tag_list=[0, 1, 2, 3, 4])
 
-trial_num = 5  # number of different trials,
-repeat = 20  # number of repeats
-metric_num = 5  # number of metrics
+if __name__ == '__main__':
+    MV = MetricVisualizer(name='example', trial_tag='Trial ID', trial_tag_list=[0, 1, 2, 3, 4])
+
+    trial_num = 5  # number of different trials,
+    repeat = 20  # number of repeats
+    metric_num = 5  # number of metrics
+
+    #  利用metric_visualizer监听实验吧并保存实验结果，随时重新绘制图像
+
+    rng = np.random.default_rng(seed=0)  # fixed seed to make the example reproducible
 
-#  利用metric_visualizer监听实验吧并保存实验结果，随时重新绘制图像
+    # generate all the (trial, repeat, metric) results at once, n in np.arange(metric_num) is metric scale factor
+    data = rng.random((trial_num, repeat, metric_num)) + np.arange(metric_num)
+    data += np.where(rng.random((trial_num, repeat, metric_num)) > 0.5, 1, -1)
 
-for n_trial in range(trial_num):
-    for r in range(repeat):  # repeat the experiments to plot violin or box figure
-        metrics = [(np.random.random() + n + (1 if random.random() > 0.5 else -1)) for n in range(metric_num)]  # n is metric scale factor
-        for i, m in enumerate(metrics):
-            MV.add_metric('metric{}'.format(i + 1), m)
-    MV.next_trial()
+    metric_names = ['metric{}'.format(i + 1) for i in range(metric_num)]
+    MV.ingest_all(data, metric_names)  # copy all the (trial, repeat, metric) results into the buffer at once
 
-save_prefix = os.getcwd()
-MV.summary(save_path=save_prefix, no_print=True)  # save fig into .tex and .pdf format
-MV.traj_plot_by_trial(save_path=save_prefix, xlabel='', xrotation=30, minorticks_on=True)  # save fig into .tex and .pdf format
-MV.violin_plot_by_trial(save_path=save_prefix)  # save fig into .tex and .pdf format
-MV.box_plot_by_trial(save_path=save_prefix)  # save fig into .tex and .pdf format
-MV.avg_bar_plot_by_trial(save_path=save_prefix)  # save fig into .tex and .pdf format
-MV.sum_bar_plot_by_trial(save_path=save_prefix)  # save fig into .tex and .pdf format
-MV.scott_knott_plot(save_path=save_prefix, minorticks_on=False)  # save fig into .tex and .pdf format
+    save_prefix = os.getcwd()
+    MV.summary(save_path=save_prefix, no_print=True)  # save fig into .tex and .pdf format
+    # plot all the figures into one .tex document and run pdflatex only once
+    MV.emit_all(save_path=save_prefix,
+                kinds={'traj_plot_by_trial': dict(xlabel='', xrotation=30, minorticks_on=True),
+                       'violin_plot_by_trial': {},
+                       'box_plot_by_trial': {},
+                       'avg_bar_plot_by_trial': {},
+                       'sum_bar_plot_by_trial': {},
+                       })
+    # an overview of all the plots by trial and by metric in one figure
+    MV.plot_grid(save_path=save_prefix)
+    MV.scott_knott_plot(save_path=save_prefix, minorticks_on=False)  # save fig into .tex and .pdf format
 
-print(MV.rank_test_by_trail('trial0'))  # save fig into .tex and .pdf format
-print(MV.rank_test_by_metric('metric1'))  # save fig into .tex and .pdf format
+    print(MV.rank_test_by_trail('trial0'))  # save fig into .tex and .pdf format
+    print(MV.rank_test_by_metric('metric1'))  # save fig into .tex and .pdf format
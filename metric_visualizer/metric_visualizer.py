@@ -4,33 +4,159 @@
 # author: yangheng <yangheng@m.scnu.edu.cn>
 # github: https://github.com/yangheng95
 # Copyright (C) 2021. All Rights Reserved.
+import array
 import os.path
 import pickle
 import random
-import shlex
+import string
 import subprocess
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 import time
 
 import matplotlib.colors
 import numpy as np
-import tikzplotlib
 from findfile import find_cwd_files
+from matplotlib import cbook
 from matplotlib import pyplot as plt
-from scipy.stats import iqr
-from scipy.stats import ranksums
-from tabulate import tabulate
 
 from metric_visualizer import __version__
 
-retry_count = 100
+# merged into a new dict instead of updating matplotlib.colors.XKCD_COLORS in place
+_COLORS_DICT = {**matplotlib.colors.XKCD_COLORS, **matplotlib.colors.CSS4_COLORS}
+_COLORS = tuple(_COLORS_DICT.values())
 
 
 def legend_without_duplicate_labels(ax):
     handles, labels = ax.get_legend_handles_labels()
-    unique = [(h, l) for i, (h, l) in enumerate(zip(handles, labels)) if l not in labels[:i]]
-    ax.legend(*zip(*unique))
+    unique = OrderedDict()
+    for h, l in zip(handles, labels):
+        unique.setdefault(l, h)  # keep the first handle of each label
+    ax.legend(list(unique.values()), list(unique.keys()))
+
+
+def _box_stats(data, whis=1.5):
+    """
+    The vectorized version of matplotlib.cbook.boxplot_stats() for the trials with the same number of values,
+    the quantiles and whiskers of all the trials are computed in one pass, the results can be drawn by Axes.bxp()
+    """
+    data = np.asarray(data, dtype=float)
+    q1, med, q3 = np.percentile(data, [25, 50, 75], axis=1)
+    iqr = q3 - q1
+    low = np.where(data >= (q1 - whis * iqr)[:, None], data, np.inf).min(axis=1)
+    high = np.where(data <= (q3 + whis * iqr)[:, None], data, -np.inf).max(axis=1)
+    whislo = np.where(low > q1, q1, low)
+    whishi = np.where(high < q3, q3, high)
+    mean = data.mean(axis=1)
+    notch = 1.57 * iqr / np.sqrt(data.shape[1])
+
+    stats = []
+    for i, values in enumerate(data):
+        stats.append({'mean': mean[i], 'med': med[i], 'q1': q1[i], 'q3': q3[i], 'iqr': iqr[i],
+                      'whislo': whislo[i], 'whishi': whishi[i], 'cilo': med[i] - notch[i], 'cihi': med[i] + notch[i],
+                      'fliers': np.concatenate([values[values < whislo[i]], values[values > whishi[i]]])})
+    return stats
+
+
+# the position of a view of the pre-allocated buffer, the views are dumped as their positions, see __getstate__()
+_BufferView = namedtuple('_BufferView', ['trial', 'start', 'index', 'length'])
+
+# the statistics of a metric, each field is an array aligned with the trials of the metric
+TrialStats = namedtuple('TrialStats', ['mean', 'sum', 'std', 'min', 'max', 'q25', 'q50', 'q75', 'iqr'])
+
+
+def _trial_stats(data):
+    """
+    Reduce the (trial, repeat, ...) array along the repeat axis in one pass, the midpoint IQR is used by the summary
+    """
+    q25, q50, q75 = np.percentile(data, [25, 50, 75], axis=1)
+    # the midpoint IQR of scipy.stats.iqr(data, axis=1, interpolation='midpoint') without importing scipy.stats
+    try:
+        iqr25, iqr75 = np.percentile(data, [25, 75], axis=1, method='midpoint')
+    except TypeError:  # numpy < 1.22
+        iqr25, iqr75 = np.percentile(data, [25, 75], axis=1, interpolation='midpoint')
+    return TrialStats(mean=np.average(data, axis=1),
+                      sum=np.sum(data, axis=1),
+                      std=np.std(data, axis=1),
+                      min=np.min(data, axis=1),
+                      max=np.max(data, axis=1),
+                      q25=q25,
+                      q50=q50,
+                      q75=q75,
+                      iqr=iqr75 - iqr25)
+
+
+def _sample_palette(population, k):
+    """
+    Sample k items from the population without duplicates, the sampled items are re-used in turn if k > len(population).
+    The population is a sequence (e.g., the COLORS tuple), it is sampled as it is without being copied.
+    """
+    sample = random.sample(population, min(k, len(population)))
+    return [sample[i % len(sample)] for i in range(k)]
+
+
+# the conversion options of tikzplotlib.get_tikz_code() tried in order before re-drawing the figure
+_TIKZ_OPTIONS = ({}, {'axis_width': '8cm'})
+
+
+class _TexTemplate(string.Template):
+    """
+    The tex templates use $name$ placeholders, they are substituted in one pass. $$ is not an escape here to keep the
+    math mode of tex untouched, and the unknown $name$ are kept as they are by safe_substitute()
+    """
+    pattern = r'\$(?:(?P<escaped>(?!))|(?P<named>[_a-z][_a-z0-9]*)\$|(?P<braced>(?!))|(?P<invalid>(?!)))'
+
+
+def _compile_tex(output, tex):
+    """
+    Compile the tex by pdflatex into output.pdf in cwd, then crop the pdf by pdfcrop in place and remove the .aux
+    and .log outputs. CalledProcessError is raised if any command fails, the .log is kept for the failed compilation.
+    """
+    subprocess.check_call(['pdflatex', '-interaction=batchmode', '-halt-on-error', tex.replace(os.path.sep, '/')],
+                          stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+    pdf = (output + '.pdf').replace(os.path.sep, '/')
+    if os.path.exists(pdf):
+        subprocess.check_call(['pdfcrop', pdf, pdf], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+    for f in (output + '.aux', output + '.log'):
+        try:
+            os.remove(f)
+        except FileNotFoundError:
+            pass
+
+
+def _compile_tex_all(texs):
+    """
+    Compile the independent tex files by _compile_tex() in parallel threads, the threads just wait for the
+    subprocesses, and each pdf is cropped as soon as its own compilation is finished.
+    :param texs: the {output: tex} dict of the tex files
+    """
+    if not texs:
+        return
+    with ThreadPoolExecutor(max_workers=min(len(texs), os.cpu_count() or 1)) as executor:
+        list(executor.map(_compile_tex, texs.keys(), texs.values()))
+
+
+def _pairwise_ranksums(data, names):
+    """
+    Run the rank-sum test of every ordered pair of samples in each group with one batched ranksums call.
+    :param data: the (group, sample, repeat) array of the samples
+    :param names: the names of the samples
+    :return: a {'name1<->name2': RanksumsResult} dict for each group
+    """
+    from scipy.stats import ranksums
+    pairs = [(i, j) for i in range(len(names)) for j in range(len(names)) if i != j]
+    if not pairs or not len(data):
+        return [{} for _ in range(len(data))]
+    first, second = (list(index) for index in zip(*pairs))
+    try:
+        result = ranksums(data[:, first], data[:, second], axis=-1)
+    except TypeError:  # the axis of ranksums is not supported by the older scipy, test the pairs one by one
+        return [{'{}<->{}'.format(names[i], names[j]): ranksums(samples[i], samples[j]) for i, j in pairs}
+                for samples in data]
+    return [{'{}<->{}'.format(names[i], names[j]): type(result)(statistic[k], pvalue[k])
+             for k, (i, j) in enumerate(pairs)}
+            for statistic, pvalue in zip(result.statistic, result.pvalue)]
 
 
 def exception_handle(f, disable=False):
@@ -48,9 +174,8 @@ def exception_handle(f, disable=False):
 
 
 class MetricVisualizer:
-    COLORS_DICT = matplotlib.colors.XKCD_COLORS
-    COLORS_DICT.update(matplotlib.colors.CSS4_COLORS)
-    COLORS = list(COLORS_DICT.values())
+    COLORS_DICT = _COLORS_DICT
+    COLORS = _COLORS
     MARKERS = [".", "o", "+", "P",
                "x", "X", "D", "d",
                ]
@@ -58,6 +183,32 @@ class MetricVisualizer:
     HATCHES = ['/', '\\', '|', '-', '+', 'x',
                'o', 'O', '.', '*']
 
+    dump_interval = 1
+
+    # the optional pre-allocated (trial, repeat, metric) buffer, see preallocate()
+    dtype = np.float32
+    _buf = None
+    _buf_index = None
+    _buf_count = None
+
+    # bumped by every change of the metrics, the cached statistics are recomputed once the version (or the shape of
+    # self.metrics) is changed, see _metrics_key() and invalidate()
+    _version = 0
+    _cached_stats = None
+    _cached_data = None
+    _trial_values = None
+
+    # the figures are closed in pyplot once a plot is finished, but the last max_cached_figures drawn figures are kept
+    # in the pool to skip re-drawing for the same plot and metrics, see _get_fig() and _get_figure()
+    max_cached_figures = 5
+    _figure_cache = None
+    _tikz_cache = None
+    _fig_pool = None
+    _cached_transpose = None
+
+    # the tex sources are collected here instead of being compiled one by one, see emit_all()
+    _tex_sink = None
+
     box_plot_tex_template = r"""
     \documentclass{article}
     \usepackage{pgfplots}
@@ -234,7 +385,7 @@ class MetricVisualizer:
     def set_traj_plot_tex_template(self, traj_plot_tex_template):
         self.traj_plot_tex_template = traj_plot_tex_template
 
-    def __init__(self, name='', trial_tag='', trial_tag_list=None, metric_dict=None):
+    def __init__(self, name='', trial_tag='', trial_tag_list=None, metric_dict=None, dtype=np.float32, dump_interval=1):
         """
         Used for plotting, e.g.,
             'Metric1': {
@@ -250,6 +401,10 @@ class MetricVisualizer:
 
         :param metric_dict: If you want to plot figure, it is recommended to add multiple trial experiments. In these trial, the experimental results
         are comparative, e.g., just minor different in these experiments.
+        :param dtype: the dtype of the pre-allocated metric buffer (see preallocate()), float32 is precise enough for
+        plotting and summary, use np.float64 if higher precision is needed.
+        :param dump_interval: next_trial() dumps the visualizer every dump_interval trials, each dump pickles all the
+        metrics, so a larger interval saves the I/O of long experiments. 0 or None disables the automatic dump.
         """
 
         if not trial_tag:
@@ -287,72 +442,525 @@ class MetricVisualizer:
 
         self.trial_id = 0
         self.dump_pointer = None
+        self.dtype = dtype
+        self.dump_interval = dump_interval
+
+    def preallocate(self, trial_num, repeat, metric_num, metric_names=None, dtype=None):
+        """
+        Pre-allocate a contiguous (trial_num, repeat, metric_num) buffer for the metrics, e.g.,
+            MV.preallocate(trial_num=5, repeat=10, metric_num=3)
+
+        add_metric() then writes into the buffer instead of appending to python lists, and the trials in self.metrics
+        become the views of the buffer, so the reductions in the plots and summary run on the numpy arrays directly.
+
+        :param trial_num: the number of trials
+        :param repeat: the max number of repeats in each trial
+        :param metric_num: the number of metrics
+        :param metric_names: the metric names in the buffer order, the names are registered by add_metric() if not given
+        :param dtype: the dtype of the buffer, default to the dtype of MetricVisualizer
+        """
+        if self.metrics:
+            raise RuntimeError('preallocate() should be called before adding any metric')
+        if metric_names is not None and len(metric_names) != metric_num:
+            raise ValueError('Expect {} metric names, got {}'.format(metric_num, len(metric_names)))
+
+        self._buf = np.empty((trial_num, repeat, metric_num), dtype=self.dtype if dtype is None else dtype)
+        self._buf_count = np.zeros((trial_num, metric_num), dtype=int)
+        self._buf_index = OrderedDict((metric_name, i) for i, metric_name in enumerate(metric_names or []))
 
     def next_trial(self):
         self.trial_id += 1
-        self.dump()
+        self._version += 1
+        if self.dump_interval and self.trial_id % self.dump_interval == 0:
+            self.dump()
+
+    def _add_buffered_values(self, metric_name, values):
+        trial_num, repeat, metric_num = self._buf.shape
+        if metric_name not in self._buf_index:
+            if len(self._buf_index) == metric_num:
+                raise ValueError('The buffer is allocated for {} metrics: {}'.format(metric_num, list(self._buf_index)))
+            self._buf_index[metric_name] = len(self._buf_index)
+        if self.trial_id >= trial_num:
+            raise ValueError('The buffer is allocated for {} trials'.format(trial_num))
+
+        i = self._buf_index[metric_name]
+        start = self._buf_count[self.trial_id, i]
+        end = start + len(values)
+        if end > repeat:
+            raise ValueError('The buffer is allocated for {} repeats of {}'.format(repeat, metric_name))
+        self._buf[self.trial_id, start:end, i] = values
+        self._buf_count[self.trial_id, i] = end
+        self.metrics.setdefault(metric_name, {})['trial{}'.format(self.trial_id)] = self._buf[self.trial_id, :end, i]
+
+    def _get_trial_values(self, metric_name):
+        """
+        Get the values of metric_name in the current trial, the values are remembered until the trial_id (or the
+        metrics dict) is changed, so the trial name is not formatted and looked up for every added value.
+        """
+        cache = self._trial_values
+        if cache is None or cache[0] is not self.metrics or cache[1] != self.trial_id:
+            cache = self._trial_values = (self.metrics, self.trial_id, {})
+        values = cache[2].get(metric_name)
+        if values is None:
+            trial = 'trial{}'.format(self.trial_id)
+            values = cache[2][metric_name] = self.metrics.setdefault(metric_name, {}).setdefault(trial, array.array('d'))
+        return values
 
     def add_metric(self, metric_name='Accuracy', value=0):
-        if metric_name in self.metrics:
-            if 'trial{}'.format(self.trial_id) not in self.metrics[metric_name]:
-                self.metrics[metric_name]['trial{}'.format(self.trial_id)] = [value]
+        self._version += 1
+        if self._buf is not None:
+            self._add_buffered_values(metric_name, (value,))
+        else:
+            self._get_trial_values(metric_name).append(value)
+
+    def add_metrics(self, metric_names, values):
+        """
+        Add a batch of metric values to the current trial, e.g.,
+            MV.add_metrics(['Accuracy', 'F1'], [[80.41, 76.79], [81.03, 77.92], [79.62, 75.63]])
+
+        :param metric_names: the metric names, one for each column of values
+        :param values: array-like in shape (repeat, metric_num), each row is a repeat of the experiment
+        """
+        values = np.asarray(values)
+        if values.ndim == 1:
+            values = values.reshape(1, -1)
+        if values.ndim != 2 or values.shape[1] != len(metric_names):
+            raise ValueError('Expect values in shape (repeat, {}), got {}'.format(len(metric_names), values.shape))
+
+        self._version += 1
+        for metric_name, column in zip(metric_names, values.T):
+            if self._buf is not None:
+                self._add_buffered_values(metric_name, column)
             else:
-                self.metrics[metric_name]['trial{}'.format(self.trial_id)].append(value)
+                self._get_trial_values(metric_name).extend(column.tolist())
+
+    def ingest_trial(self, values):
+        """
+        Copy all the results of the current trial into the pre-allocated buffer at once and move to the next trial, e.g.,
+            MV.preallocate(trial_num=5, repeat=10, metric_num=3, metric_names=['Accuracy', 'F1', 'Loss'])
+            for trial in range(5):
+                MV.ingest_trial(data[trial])  # data in shape (trial_num, repeat, metric_num)
+
+        :param values: array-like in shape (repeat, metric_num), the columns are in the order of the buffer metric names
+        """
+        if self._buf is None:
+            raise RuntimeError('ingest_trial() needs a pre-allocated buffer, please call preallocate() first')
+        trial_num, repeat, metric_num = self._buf.shape
+        if len(self._buf_index) != metric_num:
+            raise ValueError('The metric names of the buffer are not complete: {}, please set metric_names in preallocate()'.format(list(self._buf_index)))
+        if self.trial_id >= trial_num:
+            raise ValueError('The buffer is allocated for {} trials'.format(trial_num))
+        if self._buf_count[self.trial_id].any():
+            raise ValueError('Trial {} already has values, ingest_trial() should be called on an empty trial'.format(self.trial_id))
+
+        values = np.asarray(values)
+        if values.shape != (repeat, metric_num):
+            raise ValueError('Expect values in shape ({}, {}), got {}'.format(repeat, metric_num, values.shape))
+
+        self._version += 1
+        np.copyto(self._buf[self.trial_id], values)
+        self._buf_count[self.trial_id] = repeat
+        trial = 'trial{}'.format(self.trial_id)
+        for metric_name, i in self._buf_index.items():
+            self.metrics.setdefault(metric_name, {})[trial] = self._buf[self.trial_id, :, i]
+        self.next_trial()
+
+    def ingest_all(self, data, metric_names=None):
+        """
+        Copy the results of all the trials into a new buffer at once, e.g.,
+            MV.ingest_all(np.random.random((5, 10, 3)), metric_names=['Accuracy', 'F1', 'Loss'])
+
+        The existing metrics (and the buffer) are replaced by data, and the trial_id is moved to the end of data,
+        so ingest_all() can be called again to reload the results.
+
+        :param data: array-like in shape (trial_num, repeat, metric_num)
+        :param metric_names: the metric names of the last axis, default to Metric-1, Metric-2, ...
+        """
+        data = np.asarray(data)
+        if data.ndim != 3:
+            raise ValueError('Expect data in shape (trial_num, repeat, metric_num), got {}'.format(data.shape))
+        trial_num, repeat, metric_num = data.shape
+        if metric_names is None:
+            metric_names = ['Metric-{}'.format(i + 1) for i in range(metric_num)]
+        if len(metric_names) != metric_num:
+            raise ValueError('Expect {} metric names, got {}'.format(metric_num, len(metric_names)))
+
+        self.metrics = OrderedDict()
+        self.trial_rank_test_result = {}
+        self.metric_rank_test_result = {}
+        self.invalidate()
+        self.preallocate(trial_num, repeat, metric_num, metric_names=metric_names)
+        self._version += 1
+        np.copyto(self._buf, data)
+        self._buf_count[:] = repeat
+        for metric_name, i in self._buf_index.items():
+            self.metrics[metric_name] = {'trial{}'.format(trial): self._buf[trial, :, i] for trial in range(trial_num)}
+        self.trial_id = trial_num
+        if self.dump_interval:
+            self.dump()
+
+    def _compute_all_stats(self):
+        """
+        Compute the statistics of all the metrics and trials, the pre-allocated buffer is reduced in one pass if
+        all the trials are filled with the same number of repeats, otherwise the trials of each metric with the same
+        number of values are reduced together.
+        """
+        stats = OrderedDict()
+        if self.metrics and self._is_buffered():
+            counts = self._buf_count[:, [self._buf_index[mn] for mn in self.metrics]]
+            trial_num = int(np.count_nonzero(counts.any(axis=1)))
+            repeat = counts[0, 0]
+            trial_names = ['trial{}'.format(trial) for trial in range(trial_num)]
+            filled = trial_num and np.all(counts[:trial_num] == repeat) and not counts[trial_num:].any()
+            if filled and all(list(metrics) == trial_names for metrics in self.metrics.values()):
+                columns = _trial_stats(self._buf[:trial_num, :repeat])
+                for mn in self.metrics:
+                    i = self._buf_index[mn]
+                    stats[mn] = TrialStats(*(column[:, i] for column in columns))
+                return stats
+
+        # the values added by add_metric() are all float64, so the trials of each metric are the (trial, repeat) slices
+        # of the array shared with transpose() and the rank tests, and they are not converted again
+        metric_names, trial_names, data = self._get_data()
+        if data is not None and all(isinstance(values, array.array) and values.typecode == 'd'
+                                    for metrics in self.metrics.values() for values in metrics.values()):
+            for i, mn in enumerate(metric_names):
+                stats[mn] = _trial_stats(data[i])
+            return stats
+
+        for mn, metrics in self.metrics.items():
+            trial_values = list(metrics.values())
+            if len(set(len(values) for values in trial_values)) == 1:
+                stats[mn] = _trial_stats(np.array(trial_values))
+            else:
+                # the trials of the same length are reduced together, then put back in the order of the trials
+                lengths = OrderedDict()
+                for i, values in enumerate(trial_values):
+                    lengths.setdefault(len(values), []).append(i)
+                groups = [_trial_stats(np.array([trial_values[i] for i in index])) for index in lengths.values()]
+                order = np.argsort(np.concatenate(list(lengths.values())), kind='stable')
+                stats[mn] = TrialStats(*(np.concatenate(column)[order] for column in zip(*groups)))
+        return stats
+
+    def _metrics_key(self):
+        """
+        The key of the cached statistics, data and figures. It consists of the version bumped by add_metric(),
+        add_metrics() and next_trial(), and the metric names, trial names and the values (by identity and length)
+        of self.metrics, so the caches are also refreshed if self.metrics is edited directly, e.g.,
+            MV.metrics['F1'] = MV.metrics.pop('Macro-F1')
+        """
+        return self._version, tuple((mn, tuple((trial, id(values), len(values)) for trial, values in metrics.items()))
+                                    for mn, metrics in self.metrics.items())
+
+    def invalidate(self):
+        """
+        Drop the cached statistics and figures. The values changed in place can not be detected by the caches,
+        so call it after such changes, e.g.,
+            MV.metrics['Accuracy']['trial0'][0] = 80.41
+            MV.invalidate()
+        """
+        self._version += 1
+        self._trial_values = None
+
+    def _is_buffer_view(self, values):
+        # the base of a view is the owner of the memory, which is not the buffer itself once the buffer is loaded
+        owner = self._buf if self._buf.base is None else self._buf.base
+        return isinstance(values, np.ndarray) and values.base is owner
+
+    def _is_buffered(self):
+        # the metrics can be edited directly, so the buffer is used only if all the values are still its views
+        return self._buf is not None and all(
+            mn in self._buf_index and all(self._is_buffer_view(values) for values in metrics.values())
+            for mn, metrics in self.metrics.items())
+
+    def _get_stats(self):
+        """
+        Get the statistics of all the metrics (see _compute_all_stats()), the statistics are computed lazily and
+        shared by summary() and the plots until the metrics are changed (see _metrics_key()).
+        """
+        key = self._metrics_key()
+        if self._cached_stats is None or self._cached_stats[0] != key:
+            self._cached_stats = (key, self._compute_all_stats())
+        return self._cached_stats[1]
+
+    def _compute_data(self):
+        """
+        Get the metrics as one (metric, trial, repeat) array together with the metric names and trial names, the array
+        is a view of the pre-allocated buffer if possible. The array is None if the metrics are not in the same shape.
+        """
+        metric_names = list(self.metrics)
+        trial_names = list(self.metrics[metric_names[0]]) if metric_names else []
+        lengths = set()
+        for metrics in self.metrics.values():
+            if list(metrics) != trial_names:
+                return metric_names, trial_names, None
+            lengths.update(len(values) for values in metrics.values())
+        if len(lengths) != 1:
+            return metric_names, trial_names, None
+
+        if self._is_buffered() and trial_names == ['trial{}'.format(trial) for trial in range(len(trial_names))]:
+            index = [self._buf_index[mn] for mn in metric_names]
+            block = self._buf[:len(trial_names), :lengths.pop()]
+            if index != list(range(len(index))):
+                block = block[:, :, index]
+            return metric_names, trial_names, block.transpose(2, 0, 1)
+        return metric_names, trial_names, np.array([list(metrics.values()) for metrics in self.metrics.values()])
+
+    def _get_data(self):
+        key = self._metrics_key()
+        if self._cached_data is None or self._cached_data[0] != key:
+            self._cached_data = (key, self._compute_data())
+        return self._cached_data[1]
+
+    def _get_transposed(self):
+        key = self._metrics_key()
+        if self._cached_transpose is None or self._cached_transpose[0] != key:
+            self._cached_transpose = (key, self.transpose())
+        return self._cached_transpose[1]
+
+    def _get_fig(self, name):
+        """
+        Create a new figure of the name in the figure pool. The previous figure of the name may be held by the caller
+        of the plot, so it is released instead of being cleared and re-drawn, and the least recently used figures are
+        released if there are more than max_cached_figures figures in the pool.
+        """
+        if self._fig_pool is None:
+            self._fig_pool = OrderedDict()
+
+        self._close_fig(name)
+        fig = plt.figure()
+        self._fig_pool[name] = fig
+        while len(self._fig_pool) > max(self.max_cached_figures, 1):
+            self._close_fig(next(iter(self._fig_pool)))
+        return fig
+
+    def _close_fig(self, name):
+        # the closed figure can still be saved by its holder, but it is not drawn again
+        fig = self._fig_pool.pop(name, None)
+        if fig is not None:
+            plt.close(fig)
+        (self._figure_cache or {}).pop(name, None)
+        (self._tikz_cache or {}).pop(name, None)
+
+    @staticmethod
+    def _reopen_fig(fig):
+        """
+        Make the cached figure the current figure of pyplot again, the figure is closed by the last plot. False is
+        returned if the closed figure can not be managed by pyplot again (the older matplotlib), then it is re-drawn.
+        """
+        try:
+            plt.figure(fig)
+        except ValueError:
+            return False
+        return True
+
+    def _figure_slot(self, draw, plot_metrics):
+        if plot_metrics is self.metrics:
+            return draw.__name__, 'trial'
+        elif self._cached_transpose is not None and plot_metrics is self._cached_transpose[1]:
+            return draw.__name__, 'metric'
         else:
-            self.metrics[metric_name] = {'trial{}'.format(self.trial_id): [value]}
+            return draw.__name__, None
+
+    def _get_figure(self, draw, plot_metrics, **kwargs):
+        """
+        Draw the figure by draw(plot_metrics, **kwargs) and make it the current figure. The figure of self.metrics
+        and its transposed metrics is cached per plot, so calling a plot again (e.g., to save the previewed figure)
+        just re-uses the figure until the metrics are changed by add_metric(), add_metrics() or next_trial().
+        Note that the previous figure of the plot is closed (see _get_fig()) once the plot is re-drawn.
+        """
+        if self._figure_cache is None:
+            self._figure_cache = {}
+
+        slot = self._figure_slot(draw, plot_metrics)
+        key = (self._metrics_key(), repr(sorted(kwargs.items())))
+        fig = (self._fig_pool or {}).get(slot)
+        if slot in self._figure_cache and fig is not None:
+            cached_key, result = self._figure_cache[slot]
+            if cached_key == key and self._reopen_fig(fig):
+                self._fig_pool.move_to_end(slot)
+                return result
+
+        self._figure_cache.pop(slot, None)
+        self._get_fig(slot)
+        result = draw(plot_metrics, **kwargs)
+        if slot[1] is not None:
+            self._figure_cache[slot] = (key, result)
+        return result
+
+    def _get_tikz_code(self, draw, plot_metrics, retries=3, **kwargs):
+        """
+        Get the tikz code of the current figure drawn by draw(plot_metrics, **kwargs). If tikzplotlib fails to convert
+        the figure, the conversion is tried again with the fallback options on the same figure, then the figure is
+        re-drawn (with other random colors and hatches) and converted again for at most retries times.
+        The tikz code of a cached figure (see _get_figure()) is cached with it, so saving the same figure again does
+        not convert it again.
+        """
+        import tikzplotlib
+        if self._tikz_cache is None:
+            self._tikz_cache = {}
+
+        slot = self._figure_slot(draw, plot_metrics)
+        entry = self._figure_cache.get(slot)
+        if entry is not None and slot in self._tikz_cache and self._tikz_cache[slot][0] is entry:
+            return self._tikz_cache[slot][1]
+
+        for retry in range(retries, -1, -1):
+            # convert the figure of the plot in the figure pool rather than whatever pyplot's current figure is
+            figure = (self._fig_pool or {}).get(slot, 'gcf')
+            for options in _TIKZ_OPTIONS:
+                try:
+                    tikz_code = tikzplotlib.get_tikz_code(figure=figure, **options)
+                except ValueError as e:
+                    error = e
+                else:
+                    # a re-drawn figure is a new entry of the figure cache, which invalidates the cached tikz code
+                    entry = self._figure_cache.get(slot)
+                    if entry is not None:
+                        self._tikz_cache[slot] = (entry, tikz_code)
+                    return tikz_code
+            if not retry:
+                raise RuntimeError(error)
+            self._figure_cache.pop(slot, None)
+            self._get_figure(draw, plot_metrics, **kwargs)
+
+    def _clear_figure_cache(self):
+        for fig in (self._fig_pool or {}).values():
+            plt.close(fig)
+        self._fig_pool = OrderedDict()
+        self._figure_cache = {}
+        self._tikz_cache = {}
+
+    def _find_buffer_view(self, values):
+        """
+        Get the position of values in the pre-allocated buffer, None is returned if values is not a view of a
+        (trial, repeat range, metric) column of the buffer.
+        """
+        if not self._is_buffer_view(values) or values.ndim != 1:
+            return None
+        trial_num, repeat, metric_num = self._buf.shape
+        if values.strides != (self._buf.strides[1],) or not self._buf.flags.c_contiguous:
+            return None
+        offset, remainder = divmod(values.ctypes.data - self._buf.ctypes.data, self._buf.itemsize)
+        trial, offset = divmod(offset, repeat * metric_num)
+        start, index = divmod(offset, metric_num)
+        if remainder or not 0 <= trial < trial_num:
+            return None
+        return _BufferView(trial, start, index, len(values))
+
+    def __getstate__(self):
+        # the figures and caches are not dumped with the metrics
+        state = self.__dict__.copy()
+        for attr in ('_figure_cache', '_tikz_cache', '_fig_pool', '_cached_stats', '_cached_data', '_cached_transpose',
+                     '_tex_sink', '_trial_values'):
+            state.pop(attr, None)
+        if self._buf is not None:
+            # the views of the buffer are dumped as their positions instead of the copies of the values
+            state['metrics'] = type(self.metrics)(
+                (mn, {trial: self._find_buffer_view(values) or values for trial, values in metrics.items()})
+                for mn, metrics in self.metrics.items())
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._buf is not None:
+            for metrics in self.metrics.values():
+                for trial, values in metrics.items():
+                    if isinstance(values, _BufferView):
+                        metrics[trial] = self._buf[values.trial, values.start:values.start + values.length, values.index]
 
     def traj_plot_by_metric(self, save_path=None, **kwargs):
-        plot_metrics = self.transpose()
-        self.traj_plot(plot_metrics, save_path, **kwargs)
+        plot_metrics = self._get_transposed()
+        return self.traj_plot(plot_metrics, save_path, **kwargs)
 
     def box_plot_by_metric(self, save_path=None, **kwargs):
-        plot_metrics = self.transpose()
-        self.box_plot(plot_metrics, save_path, **kwargs)
+        plot_metrics = self._get_transposed()
+        return self.box_plot(plot_metrics, save_path, **kwargs)
 
     def avg_bar_plot_by_metric(self, save_path=None, **kwargs):
-        plot_metrics = self.transpose()
-        self.avg_bar_plot(plot_metrics, save_path, **kwargs)
+        plot_metrics = self._get_transposed()
+        return self.avg_bar_plot(plot_metrics, save_path, **kwargs)
 
     def sum_bar_plot_by_metric(self, save_path=None, **kwargs):
-        plot_metrics = self.transpose()
-        self.sum_bar_plot(plot_metrics, save_path, **kwargs)
+        plot_metrics = self._get_transposed()
+        return self.sum_bar_plot(plot_metrics, save_path, **kwargs)
 
     def violin_plot_by_metric(self, save_path=None, **kwargs):
-        plot_metrics = self.transpose()
-        self.violin_plot(plot_metrics, save_path, **kwargs)
+        plot_metrics = self._get_transposed()
+        return self.violin_plot(plot_metrics, save_path, **kwargs)
 
     def traj_plot_by_trial(self, save_path=None, **kwargs):
         plot_metrics = self.metrics
-        self.traj_plot(plot_metrics, save_path, **kwargs)
+        return self.traj_plot(plot_metrics, save_path, **kwargs)
 
     def box_plot_by_trial(self, save_path=None, **kwargs):
         plot_metrics = self.metrics
-        self.box_plot(plot_metrics, save_path, **kwargs)
+        return self.box_plot(plot_metrics, save_path, **kwargs)
 
     def avg_bar_plot_by_trial(self, save_path=None, **kwargs):
         plot_metrics = self.metrics
-        self.avg_bar_plot(plot_metrics, save_path, **kwargs)
+        return self.avg_bar_plot(plot_metrics, save_path, **kwargs)
 
     def sum_bar_plot_by_trial(self, save_path=None, **kwargs):
         plot_metrics = self.metrics
-        self.sum_bar_plot(plot_metrics, save_path, **kwargs)
+        return self.sum_bar_plot(plot_metrics, save_path, **kwargs)
 
     def violin_plot_by_trial(self, save_path=None, **kwargs):
         plot_metrics = self.metrics
-        self.violin_plot(plot_metrics, save_path, **kwargs)
+        return self.violin_plot(plot_metrics, save_path, **kwargs)
 
     @exception_handle
     def traj_plot(self, plot_metrics=None, save_path=None, **kwargs):
 
-        markers = self.MARKERS[:]
-        colors = self.COLORS[:]
-        hatches = self.HATCHES[:]
-
         if isinstance(plot_metrics, str):  # warning for early version (<0.4.0)
             print('Please do not use this function directly for version (<0.4.0)')
         if not plot_metrics:
             plot_metrics = self.metrics
 
+        xlabel = kwargs.get('xlabel', None)
+
+        ylabel = kwargs.get('ylabel', None)
+
+        xlabelshift = kwargs.pop('xlabelshift', 1)
+
+        ylabelshift = kwargs.pop('ylabelshift', 1)
+
+        xtickshift = kwargs.pop('xtickshift', 1)
+
+        ytickshift = kwargs.pop('ytickshift', 1)
+
+        trial_tag_list, tex_xtick = self._get_figure(self._draw_traj_plot, plot_metrics, **kwargs)
+        fig = plt.gcf()
+
+        if save_path:
+            tikz_code = self._get_tikz_code(self._draw_traj_plot, plot_metrics, **kwargs)
+
+            tex_src = _TexTemplate(self.traj_plot_tex_template).safe_substitute(
+                tikz_code=tikz_code,
+                xticklabel=','.join(map(str, tex_xtick)),
+                xtick=','.join(map(str, range(len(tex_xtick)))),
+                xlabel=', '.join(trial_tag_list) if xlabel is None else xlabel,
+                ylabel=', '.join(plot_metrics) if ylabel is None else ylabel,
+                xtickshift=xtickshift,
+                ytickshift=ytickshift,
+                xlabelshift=xlabelshift,
+                ylabelshift=ylabelshift
+            )
+
+            # tex_src = fix_tex_traj_plot_legend(tex_src, self.metrics)
+
+            self._emit_tikz(tex_src, save_path, '_metric_traj_plot')
+        else:
+            plt.show()
+        print('Traj plot finished')
+        plt.close(fig)
+        return fig
+
+    def _draw_traj_plot(self, plot_metrics, ax=None, **kwargs):
+        markers = self.MARKERS[:]
+        colors = self.COLORS
+        hatches = self.HATCHES[:]
+
         alpha = kwargs.pop('alpha', 0.1)
 
         legend_loc = kwargs.pop('legend_loc', 2)
@@ -375,20 +983,31 @@ class MetricVisualizer:
 
         yrotation = kwargs.pop('yrotation', 0)
 
-        xlabelshift = kwargs.pop('xlabelshift', 1)
+        minorticks_on = kwargs.pop('minorticks_on', False)
 
-        ylabelshift = kwargs.pop('ylabelshift', 1)
+        legend = kwargs.pop('legend', True)
 
-        xtickshift = kwargs.pop('xtickshift', 1)
+        draw_avg_point = kwargs.pop('avg_point', True)
 
-        ytickshift = kwargs.pop('ytickshift', 1)
+        draw_traj_fill = kwargs.pop('traj_fill', True)
 
-        minorticks_on = kwargs.pop('minorticks_on', False)
+        draw_traj_point = kwargs.pop('traj_point', True)
+
+        if ax is None:
+            ax = plt.subplot()
+        else:
+            plt.sca(ax)
 
         traj_parts = []
         legend_labels = []
+        markers = _sample_palette(markers, len(plot_metrics))
+        colors = _sample_palette(colors, len(plot_metrics))
         trial_tag_list = kwargs.get('trial_tag_list ', self.trial_tag_list)
-        for metric_name in plot_metrics.keys():
+        # the x positions are shared by all metrics if the metrics have the same number of trials
+        trial_nums = {len(metrics) for metrics in plot_metrics.values()}
+        x_trial = np.arange(trial_nums.pop()) if len(trial_nums) == 1 else None
+        metric_names = list(plot_metrics)
+        for i, metric_name in enumerate(metric_names):
             metrics = plot_metrics[metric_name]
             if not trial_tag_list or len(trial_tag_list) != len(metrics.keys()):
                 if self.trial_tag_list:
@@ -396,127 +1015,124 @@ class MetricVisualizer:
                 trial_tag_list = list(metrics.keys())
             else:
                 trial_tag_list = trial_tag_list
-            ax = plt.subplot()
-
-            y = np.array([metrics[metric_name] for metric_name in metrics])
-            x = np.array([[i for i, label in enumerate(metrics)] for _ in range(y.shape[1])])
+            y = np.stack(list(metrics.values()))
+            x = x_trial if x_trial is not None else np.arange(y.shape[0])
 
             # y_avg = np.median(y, axis=1)
-            y_avg = np.average(y, axis=1)
-            y_std = np.std(y, axis=1)
-            if not markers:
-                markers = self.MARKERS[:]
-            marker = random.choice(markers)
-            markers.remove(marker)
-            if not colors:
-                colors = self.COLORS[:]
-            color = random.choice(colors)
-            colors.remove(color)
-
-            if kwargs.pop('avg_point', True):
-                avg_point = ax.plot(x[0],
+            if plot_metrics is self.metrics:
+                y_avg = self._get_stats()[metric_name].mean
+                y_std = self._get_stats()[metric_name].std
+            else:
+                y_avg = y.mean(axis=1)
+                y_std = y.std(axis=1)
+            marker = markers[i]
+            color = colors[i]
+            drawn_parts = []
+
+            if draw_avg_point:
+                avg_point = ax.plot(x,
                                     y_avg,
                                     marker=marker,
                                     color=color,
                                     markersize=markersize,
                                     linewidth=linewidth
                                     )
-
-            if kwargs.pop('traj_fill', True):
-                traj_fill = plt.subplot().fill_between(x[0],
-                                                       y_avg - y_std,
-                                                       y_avg + y_std,
-                                                       color=color,
-                                                       alpha=alpha
-                                                       )
-
-            if kwargs.pop('traj_point', True):
+                drawn_parts.append(avg_point[0])
+
+            if draw_traj_fill:
+                traj_fill = ax.fill_between(x,
+                                            y_avg - y_std,
+                                            y_avg + y_std,
+                                            color=color,
+                                            alpha=alpha
+                                            )
+                drawn_parts.append(traj_fill)
+
+            if draw_traj_point:
                 # color = random.choice(colors)
                 # colors.remove(color)
-                traj_point = plt.subplot().scatter(x,
-                                                   y,
-                                                   marker=marker,
-                                                   color=color
-                                                   )
-            tex_xtick = list(trial_tag_list) if xticks is None else xticks
-
-            traj_parts.append(avg_point[0])
-            legend_labels.append(metric_name)
-            if kwargs.get('legend', True):
-                plt.legend(traj_parts, legend_labels, loc=legend_loc)
-
-        plt.grid()
+                traj_point = ax.scatter(np.repeat(x, y.shape[1]),
+                                        y.ravel(),
+                                        marker=marker,
+                                        color=color
+                                        )
+                drawn_parts.append(traj_point)
+
+            # the legend handle of the metric is the first element drawn for it
+            if drawn_parts:
+                traj_parts.append(drawn_parts[0])
+                legend_labels.append(metric_name)
+
+        if legend and traj_parts:
+            ax.legend(traj_parts, legend_labels, loc=legend_loc)
+
+        ax.grid()
         if minorticks_on:
-            plt.minorticks_on()
+            ax.minorticks_on()
 
-        plt.xticks(rotation=xrotation)
-        plt.yticks(rotation=yrotation)
-        plt.xlabel('' if xlabel is None else xlabel)
-        plt.ylabel(', '.join(list(plot_metrics.keys())) if ylabel is None else ylabel)
+        ax.tick_params(axis='x', labelrotation=xrotation)
+        ax.tick_params(axis='y', labelrotation=yrotation)
+        ax.set_xlabel('' if xlabel is None else xlabel)
+        ax.set_ylabel(', '.join(metric_names) if ylabel is None else ylabel)
 
-        if save_path:
-            global retry_count
-            try:
-                tikz_code = tikzplotlib.get_tikz_code()
-            except ValueError as e:
-                if retry_count > 0:
-                    retry_count -= 1
+        # the tex ticks only depend on the final trial tags, so they are built once after the loop
+        tex_xtick = list(trial_tag_list) if xticks is None else xticks
+        return trial_tag_list, tex_xtick
 
-                    self.traj_plot(save_path, **kwargs)
-                else:
-                    raise RuntimeError(e)
+    @exception_handle
+    def box_plot(self, plot_metrics=None, save_path=None, **kwargs):
 
-            tex_src = self.traj_plot_tex_template.replace('$tikz_code$', tikz_code)
+        if isinstance(plot_metrics, str):  # warning for early version (<0.4.0)
+            print('Please do not use this function directly for version (<0.4.0)')
+        if not plot_metrics:
+            plot_metrics = self.metrics
 
-            tex_src = tex_src.replace('$xticklabel$', ','.join(str(x) for x in tex_xtick))
-            tex_src = tex_src.replace('$xtick$', ','.join([str(x) for x in range(len(tex_xtick))]))
-            tex_src = tex_src.replace('$xlabel$', ', '.join(list(trial_tag_list)) if xlabel is None else xlabel)
-            tex_src = tex_src.replace('$ylabel$', ', '.join(list(plot_metrics.keys())) if ylabel is None else ylabel)
-            tex_src = tex_src.replace('$xtickshift$', str(xtickshift))
-            tex_src = tex_src.replace('$ytickshift$', str(ytickshift))
-            tex_src = tex_src.replace('$xlabelshift$', str(xlabelshift))
-            tex_src = tex_src.replace('$ylabelshift$', str(ylabelshift))
+        xlabel = kwargs.get('xlabel', None)
 
-            # tex_src = fix_tex_traj_plot_legend(tex_src, self.metrics)
+        ylabel = kwargs.get('ylabel', None)
 
-            plt.savefig(save_path + '/' + self.name + '.pdf', dpi=1000)
-            plt.show()
-            fout = open((save_path + '/' + self.name + '_metric_traj_plot.tikz.tex').lstrip('_'), mode='w', encoding='utf8')
-            fout.write(tex_src)
-            fout.close()
-
-            texs = find_cwd_files(['.tex', self.name, '_metric_traj_plot'])
-            for pdf in texs:
-                cmd = 'pdflatex "{}" '.format(pdf).replace(os.path.sep, '/')
-                subprocess.check_call(shlex.split(cmd), stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
-                # os.system(cmd)
-
-            pdfs = find_cwd_files(['.pdf', self.name,  '_metric_traj_plot'], exclude_key='crop')
-            for pdf in pdfs:
-                cmd = 'pdfcrop "{}" "{}" '.format(pdf, pdf).replace(os.path.sep, '/')
-                subprocess.check_call(shlex.split(cmd), stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
-                # os.system(cmd)
-
-            for f in find_cwd_files(['.aux', self.name]) + find_cwd_files(['.log',  self.name]) + find_cwd_files(['crop',  self.name]):
-                os.remove(f)
-            print('Tikz plot saved at ', find_cwd_files(['_metric_traj_plot', self.name], exclude_key='crop'))
+        xlabelshift = kwargs.pop('xlabelshift', 1)
+
+        ylabelshift = kwargs.pop('ylabelshift', 1)
+
+        xtickshift = kwargs.pop('xtickshift', 1)
+
+        ytickshift = kwargs.pop('ytickshift', 1)
+
+        trial_tag_list, tex_xtick = self._get_figure(self._draw_box_plot, plot_metrics, **kwargs)
+        fig = plt.gcf()
+
+        if save_path:
+            tikz_code = self._get_tikz_code(self._draw_box_plot, plot_metrics, **kwargs)
+
+            tex_src = _TexTemplate(self.box_plot_tex_template).safe_substitute(
+                tikz_code=tikz_code,
+                xticklabel=','.join(map(str, tex_xtick)),
+                xtick=','.join(map(str, range(len(tex_xtick)))),
+                xlabel=', '.join(trial_tag_list) if xlabel is None else xlabel,
+                ylabel=', '.join(plot_metrics) if ylabel is None else ylabel,
+                xtickshift=xtickshift,
+                ytickshift=ytickshift,
+                xlabelshift=xlabelshift,
+                ylabelshift=ylabelshift
+            )
+
+            self._emit_tikz(tex_src, save_path, '_metric_box_plot')
         else:
             plt.show()
-        print('Traj plot finished')
-        plt.close()
-
-    @exception_handle
-    def box_plot(self, plot_metrics=None, save_path=None, **kwargs):
+        print('Box plot finished')
+        plt.close(fig)
+        return fig
 
+    def _draw_box_plot(self, plot_metrics, ax=None, **kwargs):
         markers = self.MARKERS[:]
-        colors = self.COLORS[:]
+        colors = self.COLORS
         hatches = self.HATCHES[:]
 
-        if isinstance(plot_metrics, str):  # warning for early version (<0.4.0)
-            print('Please do not use this function directly for version (<0.4.0)')
-        if not plot_metrics:
-            plot_metrics = self.metrics
-        ax = plt.subplot()
+        if ax is None:
+            ax = plt.subplot()
+        else:
+            plt.sca(ax)
 
         alpha = kwargs.pop('alpha', 1)
 
@@ -538,24 +1154,20 @@ class MetricVisualizer:
 
         yrotation = kwargs.pop('yrotation', 0)
 
-        xlabelshift = kwargs.pop('xlabelshift', 1)
-
-        ylabelshift = kwargs.pop('ylabelshift', 1)
-
-        xtickshift = kwargs.pop('xtickshift', 1)
-
-        ytickshift = kwargs.pop('ytickshift', 1)
-
         linewidth = kwargs.pop('linewidth', 3)
 
         widths = kwargs.pop('widths', 0.9)
 
         minorticks_on = kwargs.pop('minorticks_on', False)
 
+        legend = kwargs.pop('legend', True)
+
         box_parts = []
         legend_labels = []
+        colors = _sample_palette(colors, len(plot_metrics))
         trial_tag_list = kwargs.get('trial_tag_list', self.trial_tag_list)
-        for metric_name in plot_metrics.keys():
+        metric_names = list(plot_metrics)
+        for i, metric_name in enumerate(metric_names):
             metrics = plot_metrics[metric_name]
             if not trial_tag_list or len(trial_tag_list) != len(metrics.keys()):
                 if trial_tag_list:
@@ -563,21 +1175,25 @@ class MetricVisualizer:
                 trial_tag_list = list(metrics.keys())
             else:
                 trial_tag_list = trial_tag_list
-            color = random.choice(colors)
-            colors.remove(color)
-            tex_xtick = list(trial_tag_list) if xticks is None else xticks
+            color = colors[i]
 
-            data = [metrics[trial] for trial in metrics.keys()]
+            data = list(metrics.values())
+            if len(set(len(values) for values in data)) == 1:
+                stats = _box_stats(data)
+            else:
+                stats = cbook.boxplot_stats(data)
 
-            boxs_parts = ax.boxplot(data, positions=list(range(len(trial_tag_list))), widths=widths, meanline=True)
+            boxs_parts = ax.bxp(stats, positions=list(range(len(trial_tag_list))), widths=widths, meanline=True)
 
             box_parts.append(boxs_parts['boxes'][0])
             legend_labels.append(metric_name)
 
             for item in ['boxes', 'whiskers', 'fliers', 'medians', 'caps']:
-                plt.setp(boxs_parts[item], color=color)
+                for artist in boxs_parts[item]:
+                    artist.set_color(color)
 
-            plt.setp(boxs_parts["fliers"], markeredgecolor=color)
+            for artist in boxs_parts["fliers"]:
+                artist.set_markeredgecolor(color)
 
         plt.grid()
         if minorticks_on:
@@ -585,73 +1201,70 @@ class MetricVisualizer:
         plt.xticks(rotation=xrotation)
         plt.yticks(rotation=yrotation)
         plt.xlabel('' if xlabel is None else xlabel)
-        plt.ylabel(', '.join(list(plot_metrics.keys())) if ylabel is None else ylabel)
+        plt.ylabel(', '.join(metric_names) if ylabel is None else ylabel)
 
-        if kwargs.get('legend', True):
+        if legend:
             plt.legend(box_parts, legend_labels, loc=legend_loc)
 
-        if save_path:
-            global retry_count
-            try:
-                tikz_code = tikzplotlib.get_tikz_code()
-            except ValueError as e:
-                if retry_count > 0:
-                    retry_count -= 1
+        tex_xtick = list(trial_tag_list) if xticks is None else xticks
+        return trial_tag_list, tex_xtick
 
-                    self.traj_plot(save_path, **kwargs)
-                else:
-                    raise RuntimeError(e)
+    @exception_handle
+    def avg_bar_plot(self, plot_metrics=None, save_path=None, **kwargs):
 
-            tex_src = self.box_plot_tex_template.replace('$tikz_code$', tikz_code)
+        if isinstance(plot_metrics, str):  # warning for early version (<0.4.0)
+            print('Please do not use this function directly for version (<0.4.0)')
+        if not plot_metrics:
+            plot_metrics = self.metrics
 
-            tex_src = tex_src.replace('$xticklabel$', ','.join([str(x) for x in tex_xtick]))
-            tex_src = tex_src.replace('$xtick$', ','.join([str(x) for x in range(len(tex_xtick))]))
-            tex_src = tex_src.replace('$xlabel$', ', '.join(list(trial_tag_list)) if xlabel is None else xlabel)
-            tex_src = tex_src.replace('$ylabel$', ', '.join(list(plot_metrics.keys())) if ylabel is None else ylabel)
-            tex_src = tex_src.replace('$xtickshift$', str(xtickshift))
-            tex_src = tex_src.replace('$ytickshift$', str(ytickshift))
-            tex_src = tex_src.replace('$xlabelshift$', str(xlabelshift))
-            tex_src = tex_src.replace('$ylabelshift$', str(ylabelshift))
+        xlabel = kwargs.get('xlabel', None)
 
-            plt.savefig(save_path + '/' + self.name + '.pdf', dpi=1000)
-            plt.show()
-            fout = open((save_path + '/' + self.name + '_metric_box_plot.tikz.tex').lstrip('_'), mode='w', encoding='utf8')
-            fout.write(tex_src)
-            fout.close()
-
-            texs = find_cwd_files(['.tex', self.name, '_metric_box_plot'])
-            for pdf in texs:
-                cmd = 'pdflatex "{}" '.format(pdf).replace(os.path.sep, '/')
-                subprocess.check_call(shlex.split(cmd), stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
-                # os.system(cmd)
-
-            pdfs = find_cwd_files(['.pdf', self.name,  '_metric_box_plot'], exclude_key='crop')
-            for pdf in pdfs:
-                cmd = 'pdfcrop "{}" "{}" '.format(pdf, pdf).replace(os.path.sep, '/')
-                subprocess.check_call(shlex.split(cmd), stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
-                # os.system(cmd)
-
-            for f in find_cwd_files(['.aux', self.name]) + find_cwd_files(['.log',  self.name]) + find_cwd_files(['crop',  self.name]):
-                os.remove(f)
-            print('Tikz plot saved at ', find_cwd_files(['_metric_box_plot', self.name], exclude_key='crop'))
+        ylabel = kwargs.get('ylabel', None)
+
+        xlabelshift = kwargs.pop('xlabelshift', 1)
+
+        ylabelshift = kwargs.pop('ylabelshift', 1)
+
+        xtickshift = kwargs.pop('xtickshift', 1)
+
+        ytickshift = kwargs.pop('ytickshift', 1)
+
+        trial_tag_list, tex_xtick = self._get_figure(self._draw_avg_bar_plot, plot_metrics, tikz_legend=bool(save_path), **kwargs)
+        fig = plt.gcf()
+
+        if save_path:
+            tikz_code = self._get_tikz_code(self._draw_avg_bar_plot, plot_metrics, tikz_legend=bool(save_path), **kwargs)
+
+            tex_src = _TexTemplate(self.bar_plot_tex_template).safe_substitute(
+                tikz_code=tikz_code,
+                xticklabel=','.join(map(str, tex_xtick)),
+                xtick=','.join(map(str, range(len(tex_xtick)))),
+                xlabel=', '.join(trial_tag_list) if xlabel is None else xlabel,
+                ylabel=', '.join(plot_metrics) if ylabel is None else ylabel,
+                xtickshift=xtickshift,
+                ytickshift=ytickshift,
+                xlabelshift=xlabelshift,
+                ylabelshift=ylabelshift
+            )
+
+            self._emit_tikz(tex_src, save_path, '_metric_avg_bar_plot')
         else:
             plt.show()
-        print('Box plot finished')
-        plt.close()
-
-    @exception_handle
-    def avg_bar_plot(self, plot_metrics=None, save_path=None, **kwargs):
+        print('Avg Bar plot finished')
+        plt.close(fig)
+        return fig
 
+    def _draw_avg_bar_plot(self, plot_metrics, ax=None, **kwargs):
         markers = self.MARKERS[:]
-        colors = self.COLORS[:]
+        colors = self.COLORS
         hatches = self.HATCHES[:]
 
-        if isinstance(plot_metrics, str):  # warning for early version (<0.4.0)
-            print('Please do not use this function directly for version (<0.4.0)')
-        if not plot_metrics:
-            plot_metrics = self.metrics
+        tikz_legend = kwargs.pop('tikz_legend', False)
 
-        ax = plt.subplot()
+        if ax is None:
+            ax = plt.subplot()
+        else:
+            plt.sca(ax)
 
         alpha = kwargs.pop('alpha', 1)
 
@@ -673,24 +1286,24 @@ class MetricVisualizer:
 
         yrotation = kwargs.pop('yrotation', 0)
 
-        xlabelshift = kwargs.pop('xlabelshift', 1)
-
-        ylabelshift = kwargs.pop('ylabelshift', 1)
-
-        xtickshift = kwargs.pop('xtickshift', 1)
-
-        ytickshift = kwargs.pop('ytickshift', 1)
-
         linewidth = kwargs.pop('linewidth', 3)
 
         widths = kwargs.pop('widths', 0.9)
 
         minorticks_on = kwargs.pop('minorticks_on', False)
 
+        legend = kwargs.pop('legend', True)
+
         sum_bar_parts = []
+        hatches = _sample_palette(hatches, len(plot_metrics))
+        colors = _sample_palette(colors, len(plot_metrics))
         total_width = 0.9
         trial_tag_list = kwargs.get('trial_tag_list ', self.trial_tag_list)
-        for i, metric_name in enumerate(plot_metrics.keys()):
+        # the x positions are shared by all metrics if the metrics have the same number of trials
+        trial_nums = {len(metrics) for metrics in plot_metrics.values()}
+        x_trial = np.arange(trial_nums.pop()) if len(trial_nums) == 1 else None
+        metric_names = list(plot_metrics)
+        for i, metric_name in enumerate(metric_names):
             metrics = plot_metrics[metric_name]
             if not trial_tag_list or len(trial_tag_list) != len(metrics.keys()):
                 if trial_tag_list:
@@ -698,31 +1311,37 @@ class MetricVisualizer:
                 trial_tag_list = list(metrics.keys())
             else:
                 trial_tag_list = trial_tag_list
-            metric_num = len(plot_metrics.keys())
+            metric_num = len(metric_names)
             trial_num = len(plot_metrics[metric_name])
             width = total_width / metric_num
-            x = np.arange(trial_num)
+            x = x_trial if x_trial is not None else np.arange(trial_num)
             x = x - (total_width - width) / 2
             x = x + i * width
-            Y = np.array([np.average(plot_metrics[m_name][trial]) for m_name in plot_metrics.keys() for trial in plot_metrics[m_name] if metric_name == m_name])
-            hatch = random.choice(hatches)
-            hatches.remove(hatch)
-            color = random.choice(colors)
-            colors.remove(color)
-            if save_path:
+            if plot_metrics is self.metrics:
+                Y = self._get_stats()[metric_name].mean
+            else:
+                trial_values = list(metrics.values())
+                if len(set(len(values) for values in trial_values)) == 1:
+                    Y = np.mean(np.array(trial_values), axis=1)
+                else:
+                    Y = np.array([np.mean(values) for values in trial_values])
+            hatch = hatches[i]
+            color = colors[i]
+            if tikz_legend:
                 bar = plt.bar(x, Y, width=width, label=metric_name, hatch=hatch, color=color)
-                plt.legend()
             else:
                 bar = plt.bar(x, Y, width=width, hatch=hatch, color=color)
                 sum_bar_parts.append(bar[0])
-                legend_labels = list(plot_metrics.keys())
-                if kwargs.get('legend', True):
-                    plt.legend(sum_bar_parts, legend_labels, loc=legend_loc)
 
+            y_offset = max(Y) // 100
             for i, j in zip(x, Y):
-                plt.text(i, j + max(Y) // 100, '%.1f' % j, ha='center', va='bottom')
+                plt.text(i, j + y_offset, '%.1f' % j, ha='center', va='bottom')
 
-            tex_xtick = list(trial_tag_list) if xticks is None else xticks
+        # the legend is drawn once for all metrics
+        if tikz_legend and metric_names:
+            plt.legend()
+        elif legend and sum_bar_parts:
+            plt.legend(sum_bar_parts, metric_names, loc=legend_loc)
 
         plt.grid()
         if minorticks_on:
@@ -730,70 +1349,67 @@ class MetricVisualizer:
         plt.xticks(rotation=xrotation)
         plt.yticks(rotation=yrotation)
         plt.xlabel('' if xlabel is None else xlabel)
-        plt.ylabel(', '.join(list(plot_metrics.keys())) if ylabel is None else ylabel)
+        plt.ylabel(', '.join(metric_names) if ylabel is None else ylabel)
 
-        if save_path:
-            global retry_count
-            try:
-                tikz_code = tikzplotlib.get_tikz_code()
-            except ValueError as e:
-                if retry_count > 0:
-                    retry_count -= 1
+        tex_xtick = list(trial_tag_list) if xticks is None else xticks
+        return trial_tag_list, tex_xtick
 
-                    self.traj_plot(save_path, **kwargs)
-                else:
-                    raise RuntimeError(e)
+    @exception_handle
+    def sum_bar_plot(self, plot_metrics=None, save_path=None, **kwargs):
 
-            tex_src = self.bar_plot_tex_template.replace('$tikz_code$', tikz_code)
+        if isinstance(plot_metrics, str):  # warning for early version (<0.4.0)
+            print('Please do not use this function directly for version (<0.4.0)')
+        if not plot_metrics:
+            plot_metrics = self.metrics
 
-            tex_src = tex_src.replace('$xticklabel$', ','.join([str(x) for x in tex_xtick]))
-            tex_src = tex_src.replace('$xtick$', ','.join([str(x) for x in range(len(tex_xtick))]))
-            tex_src = tex_src.replace('$xlabel$', ', '.join(list(trial_tag_list)) if xlabel is None else xlabel)
-            tex_src = tex_src.replace('$ylabel$', ', '.join(list(plot_metrics.keys())) if ylabel is None else ylabel)
-            tex_src = tex_src.replace('$xtickshift$', str(xtickshift))
-            tex_src = tex_src.replace('$ytickshift$', str(ytickshift))
-            tex_src = tex_src.replace('$xlabelshift$', str(xlabelshift))
-            tex_src = tex_src.replace('$ylabelshift$', str(ylabelshift))
+        xlabel = kwargs.get('xlabel', None)
 
-            plt.savefig(save_path + '/' + self.name + '.pdf', dpi=1000)
-            plt.show()
-            fout = open((save_path + '/' + self.name + '_metric_avg_bar_plot.tikz.tex').lstrip('_'), mode='w', encoding='utf8')
-            fout.write(tex_src)
-            fout.close()
-
-            texs = find_cwd_files(['.tex', self.name, '_metric_avg_bar_plot'])
-            for pdf in texs:
-                cmd = 'pdflatex "{}" '.format(pdf).replace(os.path.sep, '/')
-                subprocess.check_call(shlex.split(cmd), stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
-                # os.system(cmd)
-
-            pdfs = find_cwd_files(['.pdf', self.name,  '_metric_avg_bar_plot'], exclude_key='crop')
-            for pdf in pdfs:
-                cmd = 'pdfcrop "{}" "{}" '.format(pdf, pdf).replace(os.path.sep, '/')
-                subprocess.check_call(shlex.split(cmd), stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
-                # os.system(cmd)
-
-            for f in find_cwd_files(['.aux', self.name]) + find_cwd_files(['.log',  self.name]) + find_cwd_files(['crop',  self.name]):
-                os.remove(f)
-            print('Tikz plot saved at ', find_cwd_files(['_metric_avg_bar_plot', self.name], exclude_key='crop'))
+        ylabel = kwargs.get('ylabel', None)
+
+        xlabelshift = kwargs.pop('xlabelshift', 1)
+
+        ylabelshift = kwargs.pop('ylabelshift', 1)
+
+        xtickshift = kwargs.pop('xtickshift', 1)
+
+        ytickshift = kwargs.pop('ytickshift', 1)
+
+        trial_tag_list, tex_xtick = self._get_figure(self._draw_sum_bar_plot, plot_metrics, tikz_legend=bool(save_path), **kwargs)
+        fig = plt.gcf()
+
+        if save_path:
+            tikz_code = self._get_tikz_code(self._draw_sum_bar_plot, plot_metrics, tikz_legend=bool(save_path), **kwargs)
+
+            tex_src = _TexTemplate(self.bar_plot_tex_template).safe_substitute(
+                tikz_code=tikz_code,
+                xticklabel=','.join(map(str, tex_xtick)),
+                xtick=','.join(map(str, range(len(tex_xtick)))),
+                xlabel=', '.join(trial_tag_list) if xlabel is None else xlabel,
+                ylabel=', '.join(plot_metrics) if ylabel is None else ylabel,
+                xtickshift=xtickshift,
+                ytickshift=ytickshift,
+                xlabelshift=xlabelshift,
+                ylabelshift=ylabelshift
+            )
+
+            self._emit_tikz(tex_src, save_path, '_metric_sum_bar_plot')
         else:
             plt.show()
-        print('Avg Bar plot finished')
-        plt.close()
-
-    @exception_handle
-    def sum_bar_plot(self, plot_metrics=None, save_path=None, **kwargs):
+        print('Sum Bar plot finished')
+        plt.close(fig)
+        return fig
 
+    def _draw_sum_bar_plot(self, plot_metrics, ax=None, **kwargs):
         markers = self.MARKERS[:]
-        colors = self.COLORS[:]
+        colors = self.COLORS
         hatches = self.HATCHES[:]
 
-        if isinstance(plot_metrics, str):  # warning for early version (<0.4.0)
-            print('Please do not use this function directly for version (<0.4.0)')
-        if not plot_metrics:
-            plot_metrics = self.metrics
+        tikz_legend = kwargs.pop('tikz_legend', False)
 
-        ax = plt.subplot()
+        if ax is None:
+            ax = plt.subplot()
+        else:
+            plt.sca(ax)
 
         alpha = kwargs.pop('alpha', 1)
 
@@ -815,24 +1431,24 @@ class MetricVisualizer:
 
         yrotation = kwargs.pop('yrotation', 0)
 
-        xlabelshift = kwargs.pop('xlabelshift', 1)
-
-        ylabelshift = kwargs.pop('ylabelshift', 1)
-
-        xtickshift = kwargs.pop('xtickshift', 1)
-
-        ytickshift = kwargs.pop('ytickshift', 1)
-
         linewidth = kwargs.pop('linewidth', 3)
 
         widths = kwargs.pop('widths', 0.9)
 
         minorticks_on = kwargs.pop('minorticks_on', False)
 
+        legend = kwargs.pop('legend', True)
+
         sum_bar_parts = []
+        hatches = _sample_palette(hatches, len(plot_metrics))
+        colors = _sample_palette(colors, len(plot_metrics))
         total_width = 0.9
         trial_tag_list = kwargs.get('trial_tag_list ', self.trial_tag_list)
-        for i, metric_name in enumerate(plot_metrics.keys()):
+        # the x positions are shared by all metrics if the metrics have the same number of trials
+        trial_nums = {len(metrics) for metrics in plot_metrics.values()}
+        x_trial = np.arange(trial_nums.pop()) if len(trial_nums) == 1 else None
+        metric_names = list(plot_metrics)
+        for i, metric_name in enumerate(metric_names):
             metrics = plot_metrics[metric_name]
             if not trial_tag_list or len(trial_tag_list) != len(metrics.keys()):
                 if trial_tag_list:
@@ -840,31 +1456,37 @@ class MetricVisualizer:
                 trial_tag_list = list(metrics.keys())
             else:
                 trial_tag_list = trial_tag_list
-            metric_num = len(plot_metrics.keys())
+            metric_num = len(metric_names)
             trial_num = len(plot_metrics[metric_name])
             width = total_width / metric_num
-            x = np.arange(trial_num)
+            x = x_trial if x_trial is not None else np.arange(trial_num)
             x = x - (total_width - width) / 2
             x = x + i * width
-            Y = np.array([np.sum(plot_metrics[m_name][trial]) for m_name in plot_metrics.keys() for trial in plot_metrics[m_name] if metric_name == m_name])
-            hatch = random.choice(hatches)
-            hatches.remove(hatch)
-            color = random.choice(colors)
-            colors.remove(color)
-            if save_path:
+            if plot_metrics is self.metrics:
+                Y = self._get_stats()[metric_name].sum
+            else:
+                trial_values = list(metrics.values())
+                if len(set(len(values) for values in trial_values)) == 1:
+                    Y = np.add.reduce(np.array(trial_values), axis=1)
+                else:
+                    Y = np.array([np.add.reduce(values) for values in trial_values])
+            hatch = hatches[i]
+            color = colors[i]
+            if tikz_legend:
                 bar = plt.bar(x, Y, width=width, label=metric_name, hatch=hatch, color=color)
-                plt.legend()
             else:
                 bar = plt.bar(x, Y, width=width, hatch=hatch, color=color)
                 sum_bar_parts.append(bar[0])
-                legend_labels = list(plot_metrics.keys())
-                if kwargs.get('legend', True):
-                    plt.legend(sum_bar_parts, legend_labels, loc=legend_loc)
 
+            y_offset = max(Y) // 100
             for i, j in zip(x, Y):
-                plt.text(i, j + max(Y) // 100, '%.1f' % j, ha='center', va='bottom')
+                plt.text(i, j + y_offset, '%.1f' % j, ha='center', va='bottom')
 
-            tex_xtick = list(trial_tag_list) if xticks is None else xticks
+        # the legend is drawn once for all metrics
+        if tikz_legend and metric_names:
+            plt.legend()
+        elif legend and sum_bar_parts:
+            plt.legend(sum_bar_parts, metric_names, loc=legend_loc)
 
         plt.grid()
         if minorticks_on:
@@ -872,68 +1494,62 @@ class MetricVisualizer:
         plt.xticks(rotation=xrotation)
         plt.yticks(rotation=yrotation)
         plt.xlabel('' if xlabel is None else xlabel)
-        plt.ylabel(', '.join(list(plot_metrics.keys())) if ylabel is None else ylabel)
+        plt.ylabel(', '.join(metric_names) if ylabel is None else ylabel)
 
-        if save_path:
-            global retry_count
-            try:
-                tikz_code = tikzplotlib.get_tikz_code()
-            except ValueError as e:
-                if retry_count > 0:
-                    retry_count -= 1
+        tex_xtick = list(trial_tag_list) if xticks is None else xticks
+        return trial_tag_list, tex_xtick
 
-                    self.traj_plot(save_path, **kwargs)
-                else:
-                    raise RuntimeError(e)
+    @exception_handle
+    def violin_plot(self, plot_metrics=None, save_path=None, **kwargs):
 
-            tex_src = self.bar_plot_tex_template.replace('$tikz_code$', tikz_code)
+        if isinstance(plot_metrics, str):  # warning for early version (<0.4.0)
+            print('Please do not use this function directly for version (<0.4.0)')
+        if not plot_metrics:
+            plot_metrics = self.metrics
 
-            tex_src = tex_src.replace('$xticklabel$', ','.join([str(x) for x in tex_xtick]))
-            tex_src = tex_src.replace('$xtick$', ','.join([str(x) for x in range(len(tex_xtick))]))
-            tex_src = tex_src.replace('$xlabel$', ', '.join(list(trial_tag_list)) if xlabel is None else xlabel)
-            tex_src = tex_src.replace('$ylabel$', ', '.join(list(plot_metrics.keys())) if ylabel is None else ylabel)
-            tex_src = tex_src.replace('$xtickshift$', str(xtickshift))
-            tex_src = tex_src.replace('$ytickshift$', str(ytickshift))
-            tex_src = tex_src.replace('$xlabelshift$', str(xlabelshift))
-            tex_src = tex_src.replace('$ylabelshift$', str(ylabelshift))
+        xlabel = kwargs.get('xlabel', None)
 
-            plt.savefig(save_path + '/' + self.name + '.pdf', dpi=1000)
-            plt.show()
-            fout = open((save_path + '/' + self.name + '_metric_sum_bar_plot.tikz.tex').lstrip('_'), mode='w', encoding='utf8')
-            fout.write(tex_src)
-            fout.close()
-
-            texs = find_cwd_files(['.tex', self.name, '_metric_sum_bar_plot'])
-            for pdf in texs:
-                cmd = 'pdflatex "{}" '.format(pdf).replace(os.path.sep, '/')
-                subprocess.check_call(shlex.split(cmd), stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
-                # os.system(cmd)
-
-            pdfs = find_cwd_files(['.pdf', self.name,  '_metric_sum_bar_plot'], exclude_key='crop')
-            for pdf in pdfs:
-                cmd = 'pdfcrop "{}" "{}" '.format(pdf, pdf).replace(os.path.sep, '/')
-                subprocess.check_call(shlex.split(cmd), stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
-                # os.system(cmd)
-
-            for f in find_cwd_files(['.aux', self.name]) + find_cwd_files(['.log',  self.name]) + find_cwd_files(['crop',  self.name]):
-                os.remove(f)
-            print('Tikz plot saved at ', find_cwd_files(['_metric_sum_bar_plot', self.name], exclude_key='crop'))
+        ylabel = kwargs.get('ylabel', None)
+
+        xlabelshift = kwargs.pop('xlabelshift', 1)
+
+        ylabelshift = kwargs.pop('ylabelshift', 1)
+
+        xtickshift = kwargs.pop('xtickshift', 1)
+
+        ytickshift = kwargs.pop('ytickshift', 1)
+
+        trial_tag_list, tex_xtick = self._get_figure(self._draw_violin_plot, plot_metrics, tikz_legend=bool(save_path), **kwargs)
+        fig = plt.gcf()
+
+        if save_path:
+            tikz_code = self._get_tikz_code(self._draw_violin_plot, plot_metrics, tikz_legend=bool(save_path), **kwargs)
+
+            tex_src = _TexTemplate(self.box_plot_tex_template).safe_substitute(
+                tikz_code=tikz_code,
+                xticklabel=','.join(map(str, tex_xtick)),
+                xtick=','.join(map(str, range(len(tex_xtick)))),
+                xlabel=', '.join(trial_tag_list) if xlabel is None else xlabel,
+                ylabel=', '.join(plot_metrics) if ylabel is None else ylabel,
+                xtickshift=xtickshift,
+                ytickshift=ytickshift,
+                xlabelshift=xlabelshift,
+                ylabelshift=ylabelshift
+            )
+
+            self._emit_tikz(tex_src, save_path, '_metric_violin_plot')
         else:
             plt.show()
-        print('Sum Bar plot finished')
-        plt.close()
-
-    @exception_handle
-    def violin_plot(self, plot_metrics=None, save_path=None, **kwargs):
+        print('Violin plot finished')
+        plt.close(fig)
+        return fig
 
+    def _draw_violin_plot(self, plot_metrics, ax=None, **kwargs):
         markers = self.MARKERS[:]
-        colors = self.COLORS[:]
+        colors = self.COLORS
         hatches = self.HATCHES[:]
 
-        if isinstance(plot_metrics, str):  # warning for early version (<0.4.0)
-            print('Please do not use this function directly for version (<0.4.0)')
-        if not plot_metrics:
-            plot_metrics = self.metrics
+        tikz_legend = kwargs.pop('tikz_legend', False)
 
         legend_labels = []
 
@@ -941,7 +1557,10 @@ class MetricVisualizer:
         #     color = violin["bodies"][0].get_facecolor().flatten()
         #     legend_labels.append((mpatches.Patch(color=color), label))
 
-        ax = plt.subplot()
+        if ax is None:
+            ax = plt.subplot()
+        else:
+            plt.sca(ax)
 
         alpha = kwargs.pop('alpha', 1)
 
@@ -963,24 +1582,18 @@ class MetricVisualizer:
 
         yrotation = kwargs.pop('yrotation', 0)
 
-        xlabelshift = kwargs.pop('xlabelshift', 1)
-
-        ylabelshift = kwargs.pop('ylabelshift', 1)
-
-        xtickshift = kwargs.pop('xtickshift', 1)
-
-        ytickshift = kwargs.pop('ytickshift', 1)
-
         linewidth = kwargs.pop('linewidth', 3)
 
         widths = kwargs.pop('widths', 0.9)
 
         minorticks_on = kwargs.pop('minorticks_on', False)
 
+        legend = kwargs.pop('legend', True)
+
         violin_parts = []
-        legend_labels = []
         trial_tag_list = kwargs.get('trial_tag_list ', self.trial_tag_list)
-        for metric_name in plot_metrics.keys():
+        metric_names = list(plot_metrics)
+        for metric_name in metric_names:
             metrics = plot_metrics[metric_name]
 
             if not kwargs.get('trial_tag_list ', trial_tag_list) or len(trial_tag_list) != len(metrics.keys()):
@@ -989,91 +1602,170 @@ class MetricVisualizer:
                 trial_tag_list = list(metrics.keys())
             else:
                 trial_tag_list = trial_tag_list
-            tex_xtick = list(trial_tag_list) if xticks is None else xticks
-            data = [metrics[trial] for trial in metrics.keys()]
-
-            if save_path:
-                violin = ax.violinplot(data, widths=widths, positions=list(range(len(trial_tag_list))), showmeans=True, showmedians=True, showextrema=True)
-                violin_parts.append(violin['bodies'][0])
-                legend_labels = list(plot_metrics.keys())
-                if kwargs.get('legend', True):
-                    plt.legend(violin_parts, legend_labels, loc=0)
-            else:
-                violin = ax.violinplot(data, widths=widths, positions=list(range(len(trial_tag_list))), showmeans=True, showmedians=True, showextrema=True)
-                violin_parts.append(violin['bodies'][0])
-                legend_labels = list(plot_metrics.keys())
-                if kwargs.get('legend', True):
-                    plt.legend(violin_parts, legend_labels, loc=legend_loc)
+            data = list(metrics.values())
+            if len(set(len(values) for values in data)) == 1:
+                # violinplot() takes the columns of a 2-D array as the datasets, so the trials are converted at once
+                data = np.array(data).T
+
+            violin = ax.violinplot(data, widths=widths, positions=list(range(len(trial_tag_list))), showmeans=True, showmedians=True, showextrema=True)
+            violin_parts.append(violin['bodies'][0])
 
             for pc in violin['bodies']:
                 pc.set_linewidth(linewidth)
 
+        # the legend is drawn once for all metrics
+        if legend and violin_parts:
+            plt.legend(violin_parts, metric_names, loc=0 if tikz_legend else legend_loc)
+
         plt.grid()
         if minorticks_on:
             plt.minorticks_on()
         plt.xticks(rotation=xrotation)
         plt.yticks(rotation=yrotation)
         plt.xlabel('' if xlabel is None else xlabel)
-        plt.ylabel(', '.join(list(plot_metrics.keys())) if ylabel is None else ylabel)
+        plt.ylabel(', '.join(metric_names) if ylabel is None else ylabel)
+
+        tex_xtick = list(trial_tag_list) if xticks is None else xticks
+        return trial_tag_list, tex_xtick
+
+    def _emit_tikz(self, tex_src, save_path, plot_name):
+        if self._tex_sink is not None:
+            self._tex_sink.append(tex_src)
+            return
+
+        plt.savefig(save_path + '/' + self.name + '.pdf', dpi=1000)
+        plt.show()
+        self._save_tikz(tex_src, save_path, plot_name)
+
+    def _save_tikz(self, tex_src, save_path, plot_name):
+        tex_path = (save_path + '/' + self.name + plot_name + '.tikz.tex').lstrip('_')
+        # an unchanged tex is not rewritten, so its pdf stays up to date and is not compiled again
+        if os.path.exists(tex_path):
+            with open(tex_path, mode='r', encoding='utf8') as fin:
+                unchanged = fin.read() == tex_src
+        else:
+            unchanged = False
+        if not unchanged:
+            with open(tex_path, mode='w', encoding='utf8') as fout:
+                fout.write(tex_src)
+
+        # pdflatex writes the outputs of each tex into cwd, so only the last tex of the same file name is compiled,
+        # and the outputs are known from the tex names without scanning cwd again
+        texs = OrderedDict((os.path.splitext(os.path.basename(tex))[0], tex) for tex in find_cwd_files(['.tex', self.name, plot_name]))
+        # like latexmk, a tex is compiled only if its pdf is older than the tex, a .log left over means the last
+        # compilation failed
+        outdated = OrderedDict((output, tex) for output, tex in texs.items()
+                               if not os.path.exists(output + '.pdf') or os.path.exists(output + '.log')
+                               or os.path.getmtime(output + '.pdf') < os.path.getmtime(tex))
+        _compile_tex_all(outdated)
+
+        print('Tikz plot saved at ', list(texs.values()) + [output + '.pdf' for output in texs if os.path.exists(output + '.pdf')])
 
-        if save_path:
-            global retry_count
-            try:
-                tikz_code = tikzplotlib.get_tikz_code()
-            except ValueError as e:
-                if retry_count > 0:
-                    retry_count -= 1
+    @staticmethod
+    def _merge_tex(tex_srcs):
+        """
+        Merge the standalone tex documents into one document, one figure per page. The preambles are merged
+        without duplicated lines and each body is put into a group, so the pgfplotsset of a figure does not leak
+        into the next figure.
+        """
+        preamble = []
+        bodies = []
+        for tex_src in tex_srcs:
+            head, _, body = tex_src.partition(r'\begin{document}')
+            body = body.rpartition(r'\end{document}')[0]
+            for line in head.splitlines():
+                if line.strip() and line.strip() not in preamble:
+                    preamble.append(line.strip())
+            bodies.append('\\begingroup\n{}\n\\endgroup\n\\clearpage\n'.format(body))
+        return '\n'.join(preamble) + '\n\\begin{document}\n' + ''.join(bodies) + '\\end{document}\n'
+
+    def emit_all(self, save_path, kinds=None, **kwargs):
+        """
+        Plot multiple figures into one tex document and compile it by pdflatex only once, e.g.,
+            MV.emit_all(save_path=os.getcwd(), kinds={'traj_plot_by_trial': {'xrotation': 30}, 'box_plot_by_trial': {}})
 
-                    self.traj_plot(save_path, **kwargs)
-                else:
-                    raise RuntimeError(e)
+        The document is saved as {name}_metric_all_plots.tikz.tex and the cropped pdf has one page per figure.
 
-            tex_src = self.box_plot_tex_template.replace('$tikz_code$', tikz_code)
+        :param save_path: the folder to save the tex document
+        :param kinds: the names of the plots, default to all the *_plot_by_trial plots. It can also be a dict
+        which maps the plot names to their own kwargs
+        :param kwargs: the kwargs shared by all the plots
+        """
+        if kinds is None:
+            kinds = ['traj_plot_by_trial', 'violin_plot_by_trial', 'box_plot_by_trial', 'avg_bar_plot_by_trial', 'sum_bar_plot_by_trial']
+        if not isinstance(kinds, dict):
+            kinds = OrderedDict((kind, {}) for kind in kinds)
 
-            tex_src = tex_src.replace('$xticklabel$', ','.join([str(x) for x in tex_xtick]))
-            tex_src = tex_src.replace('$xtick$', ','.join([str(x) for x in range(len(tex_xtick))]))
-            tex_src = tex_src.replace('$xlabel$', ', '.join(list(trial_tag_list)) if xlabel is None else xlabel)
-            tex_src = tex_src.replace('$ylabel$', ', '.join(list(plot_metrics)) if ylabel is None else ylabel)
-            tex_src = tex_src.replace('$xtickshift$', str(xtickshift))
-            tex_src = tex_src.replace('$ytickshift$', str(ytickshift))
-            tex_src = tex_src.replace('$xlabelshift$', str(xlabelshift))
-            tex_src = tex_src.replace('$ylabelshift$', str(ylabelshift))
+        self._tex_sink = []
+        try:
+            for kind, plot_kwargs in kinds.items():
+                plot_kwargs = dict(kwargs, **plot_kwargs)
+                getattr(self, kind)(save_path=save_path, **plot_kwargs)
+            tex_srcs = self._tex_sink
+        finally:
+            self._tex_sink = None
 
-            plt.savefig(save_path + '/' + self.name + '.pdf', dpi=1000)
-            plt.show()
-            fout = open((save_path + '/' + self.name + '_metric_violin_plot.tikz.tex').lstrip('_'), mode='w', encoding='utf8')
-            fout.write(tex_src)
-            fout.close()
-
-            texs = find_cwd_files(['.tex', self.name, '_metric_violin_plot'])
-            for pdf in texs:
-                cmd = 'pdflatex "{}"'.format(pdf).replace(os.path.sep, '/')
-                subprocess.check_call(shlex.split(cmd), stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
-                # os.system(cmd)
-
-            pdfs = find_cwd_files(['.pdf', self.name, '_metric_violin_plot'], exclude_key='crop')
-            for pdf in pdfs:
-                cmd = 'pdfcrop "{}" "{}"'.format(pdf, pdf).replace(os.path.sep, '/')
-                subprocess.check_call(shlex.split(cmd), stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
-                # os.system(cmd)
-
-            for f in find_cwd_files(['.aux', self.name]) + find_cwd_files(['.log',  self.name]) + find_cwd_files(['crop',  self.name]):
-                os.remove(f)
-            print('Tikz plot saved at ', find_cwd_files(['_metric_violin_plot', self.name], exclude_key='crop'))
+        if not tex_srcs:
+            raise RuntimeError('No figure is plotted by {}'.format(list(kinds)))
+        self._save_tikz(self._merge_tex(tex_srcs), save_path, '_metric_all_plots')
+
+    @exception_handle
+    def plot_grid(self, kinds=None, axes=None, save_path=None, **kwargs):
+        """
+        Plot multiple plots into one figure, one row per axis and one column per kind, e.g.,
+            MV.plot_grid(kinds=['traj', 'box'], axes=['trial', 'metric'], save_path=os.getcwd())
+
+        :param kinds: the kinds of plots in traj, violin, box, avg_bar and sum_bar, default to all of them
+        :param axes: plot the metrics by 'trial' and/or by 'metric', default to both of them
+        :param save_path: the folder to save the figure as {name}_metric_grid_plot.pdf, nothing is saved if not given
+        :param kwargs: the kwargs shared by all the plots
+        """
+        if kinds is None:
+            kinds = ['traj', 'violin', 'box', 'avg_bar', 'sum_bar']
+        if axes is None:
+            axes = ['trial', 'metric']
+        for kind in kinds:
+            if not hasattr(self, '_draw_{}_plot'.format(kind)):
+                raise ValueError('Unknown plot kind: {}, please select kinds in traj, violin, box, avg_bar and sum_bar'.format(kind))
+        for axis in axes:
+            if axis not in ('trial', 'metric'):
+                raise ValueError("Unknown axis: {}, please select axes in 'trial' and 'metric'".format(axis))
+
+        fig = self._get_fig(('plot_grid', None))
+        fig.set_size_inches(4 * len(kinds), 3 * len(axes))
+        grid = fig.subplots(len(axes), len(kinds), squeeze=False)
+        try:
+            for row, axis in zip(grid, axes):
+                plot_metrics = self.metrics if axis == 'trial' else self._get_transposed()
+                for ax, kind in zip(row, kinds):
+                    getattr(self, '_draw_{}_plot'.format(kind))(plot_metrics, ax=ax, **kwargs)
+        except Exception:
+            # the half drawn figure is not left open, the exception is reported by exception_handle
+            self._close_fig(('plot_grid', None))
+            raise
+        fig.tight_layout()
+
+        if save_path:
+            fig.savefig((save_path + '/' + self.name + '_metric_grid_plot.pdf').lstrip('_'))
+            print('Grid plot saved at ', (save_path + '/' + self.name + '_metric_grid_plot.pdf').lstrip('_'))
         else:
             plt.show()
-        print('Violin plot finished')
-        plt.close()
+        plt.close(fig)
+        return fig
 
     @exception_handle
     def transpose(self):
-        transposed_metrics = OrderedDict()
-        for metric_name in self.metrics.keys():
-            for trial_tag_list in self.metrics[metric_name].keys():
-                if trial_tag_list not in transposed_metrics:
-                    transposed_metrics[trial_tag_list] = {}
-                transposed_metrics[trial_tag_list][metric_name] = self.metrics[metric_name][trial_tag_list]
-        return transposed_metrics
+        metric_names, trial_names, data = self._get_data()
+        if data is not None:
+            # (metric, trial, repeat) -> (trial, metric, repeat), the values are the views of the array
+            data = data.transpose(1, 0, 2)
+            return OrderedDict((trial, dict(zip(metric_names, data[i]))) for i, trial in enumerate(trial_names))
+
+        transposed_metrics = defaultdict(dict)
+        for metric_name, metrics in self.metrics.items():
+            for trial, values in metrics.items():
+                transposed_metrics[trial][metric_name] = values
+        return OrderedDict(transposed_metrics)
 
     @exception_handle
     def A12_plot(self):
@@ -1089,6 +1781,13 @@ class MetricVisualizer:
 
     @exception_handle
     def _rank_test_by_trial(self):
+        from scipy.stats import ranksums
+        metric_names, trial_names, data = self._get_data()
+        if data is not None:
+            results = _pairwise_ranksums(data.transpose(1, 0, 2), metric_names)
+            self.trial_rank_test_result.update(zip(trial_names, results))
+            return self.trial_rank_test_result
+
         transposed_metrics = self.transpose()
         for trial in transposed_metrics.keys():
             self.trial_rank_test_result[trial] = {}
@@ -1110,6 +1809,12 @@ class MetricVisualizer:
 
     @exception_handle
     def _rank_test_by_metric(self):
+        from scipy.stats import ranksums
+        metric_names, trial_names, data = self._get_data()
+        if data is not None:
+            self.metric_rank_test_result.update(zip(metric_names, _pairwise_ranksums(data, trial_names)))
+            return self.metric_rank_test_result
+
         trial_tag_list = list(self.transpose().keys())
         for metric in self.metrics.keys():
             self.metric_rank_test_result[metric] = {}
@@ -1142,13 +1847,20 @@ class MetricVisualizer:
         trial_tag_list = sorted(list(data_dict['Scott-Knott Rank Test'].keys()))
         mv = MetricVisualizer(name='sk_rank', trial_tag='Scott-Knott Rank Test', trial_tag_list=trial_tag_list, metric_dict=data_dict)
         mv.box_plot_by_trial(save_path=None, ylabel='Scott-Knott Rank Test', xlabel='Model', **kwargs)
+        mv._clear_figure_cache()
 
     @exception_handle
     def summary(self, save_path=None, no_print=False, **kwargs):
-        summary_str = ' ------------------------------------- Metric Visualizer ------------------------------------- \n'
-        header = ['Metric', self.trial_tag, 'Values (First 10 values)', 'Summary']
+        table_data = self._compute_summary(**kwargs)
+        return self._emit_summary(table_data, save_path=save_path, no_print=no_print)
 
+    def _compute_summary(self, **kwargs):
+        """
+        Aggregate the statistics of all metrics and trials into the summary table rows,
+        the rows can be emitted by _emit_summary() to any number of sinks without recomputing.
+        """
         table_data = []
+        all_stats = self._get_stats()
         trial_tag_list = kwargs.get('trial_tag_list ', self.trial_tag_list)
         for mn in self.metrics.keys():
             metrics = self.metrics[mn]
@@ -1159,20 +1871,30 @@ class MetricVisualizer:
                     trial_tag_list = list(metrics.keys())
             else:
                 trial_tag_list = trial_tag_list
+
+            stats = all_stats[mn]
+            # tolist() converts the float32 statistics to python floats, a rounded np.float32 is formatted as float64,
+            # e.g., '{}'.format(round(np.float32(0.94), 2)) gives 0.9399999976158142
+            columns = [column.tolist() for column in (stats.mean, stats.q50, stats.iqr, stats.std, stats.max, stats.min)]
+
             for i, trial in enumerate(metrics.keys()):
+                # tolist() converts the values (e.g., the float32 buffer views) to python numbers in one call, python
+                # round() is kept since np.round() is not correctly rounded, e.g., np.round(2.675, 2) gives 2.68
+                head = [round(x, 2) for x in np.asarray(metrics[trial][:10]).tolist()]
                 _data = []
-                _data += [[mn, trial_tag_list[i], [round(x, 2) for x in metrics[trial][:10]]]]
+                _data += [[mn, trial_tag_list[i], head]]
                 _data[-1].append(
                     ['Avg:{}, Median: {}, IQR: {}, STD:{}, Max: {}, Min: {}'.format(
-                        round(np.average(metrics[trial]), 2),
-                        round(np.median(metrics[trial]), 2),
-                        round(np.std(metrics[trial]), 2),
-                        round(iqr(metrics[trial], rng=(25, 75), interpolation='midpoint'), 2),
-                        round(np.max(metrics[trial]), 2),
-                        round(np.min(metrics[trial]), 2)
+                        *(round(column[i], 2) for column in columns)
                     )]
                 )
                 table_data += _data
+        return table_data
+
+    def _emit_summary(self, table_data, save_path=None, no_print=False):
+        from tabulate import tabulate
+        summary_str = ' ------------------------------------- Metric Visualizer ------------------------------------- \n'
+        header = ['Metric', self.trial_tag, 'Values (First 10 values)', 'Summary']
 
         summary_str += tabulate(table_data,
                                 headers=header,
@@ -1183,10 +1905,9 @@ class MetricVisualizer:
             print(summary_str)
 
         if save_path:
-            fout = open(save_path + '/' + self.name + '_summary.txt', mode='w', encoding='utf8')
             summary_str += '\n{}\n'.format(str(self.metrics))
-            fout.write(summary_str)
-            fout.close()
+            with open(save_path + '/' + self.name + '_summary.txt', mode='w', encoding='utf8') as fout:
+                fout.write(summary_str)
 
             self.dump()
 
@@ -1203,7 +1924,8 @@ class MetricVisualizer:
         else:
             self.dump_pointer = filename
 
-        pickle.dump(self, open(self.dump_pointer, mode='wb'))
+        with open(self.dump_pointer, mode='wb') as fout:
+            pickle.dump(self, fout, protocol=pickle.HIGHEST_PROTOCOL)
 
     @staticmethod
     def load(filename='metric_visualizer.dat'):
@@ -1214,5 +1936,6 @@ class MetricVisualizer:
             else:
                 filename = max(dats)
         print('Load', filename)
-        mv = pickle.load(open(filename, mode='rb'))
+        with open(filename, mode='rb') as fin:
+            mv = pickle.load(fin)
         return mv
\ No newline at end of file
@@ -29,5 +29,5 @@ setup(
     exclude_package_date={'': ['.gitignore']},
     # Choose your license
     license='MIT',
-    install_requires=['matplotlib', 'tikzplotlib', 'findfile', 'scipy', 'tabulate'],
+    install_requires=['numpy', 'matplotlib', 'tikzplotlib', 'findfile', 'scipy', 'tabulate'],
 )
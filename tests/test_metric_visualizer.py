@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+# file: test_metric_visualizer.py
+# time: 14/10/2026
+# author: yangheng <yangheng@m.scnu.edu.cn>
+# github: https://github.com/yangheng95
+# Copyright (C) 2021. All Rights Reserved.
+import pickle
+
+import matplotlib
+
+matplotlib.use('Agg')
+import numpy as np
+import pytest
+from matplotlib import pyplot as plt
+
+from metric_visualizer import MetricVisualizer
+from metric_visualizer import metric_visualizer as mv_module
+
+
+@pytest.fixture(autouse=True)
+def in_tmp_path(tmp_path, monkeypatch):
+    # the .mv dumps and the summary are written into cwd
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def test_summary_rounds_float32_buffer():
+    mv = MetricVisualizer(name='test', dump_interval=0)
+    mv.ingest_all(np.array([[[0.1], [0.94], [0.51]]]), metric_names=['metric1'])
+
+    assert mv._compute_summary() == [
+        ['metric1', 'trial0', [0.1, 0.94, 0.51],
+         ['Avg:0.52, Median: 0.51, IQR: 0.42, STD:0.34, Max: 0.94, Min: 0.1']]
+    ]
+    summary_str = mv.summary(no_print=True)
+    assert 'Max: 0.94, Min: 0.1' in summary_str
+    assert '0.9399999976158142' not in summary_str
+
+
+def test_returned_figure_is_not_redrawn():
+    plt.close('all')
+    mv = MetricVisualizer(name='test', dump_interval=0)
+    for trial in range(3):
+        mv.add_metrics(['metric1', 'metric2'], np.random.random((4, 2)))
+        mv.next_trial()
+
+    fig = mv.box_plot_by_trial()
+    n_axes = len(fig.axes)
+    n_artists = len(fig.axes[0].get_children())
+    assert mv.box_plot_by_trial() is fig  # the cached figure is returned again
+
+    mv.add_metric('metric1', 0.5)
+    new_fig = mv.box_plot_by_trial()
+    assert new_fig is not fig
+    assert len(fig.axes) == n_axes and len(fig.axes[0].get_children()) == n_artists
+    assert all(plt.figure(num) is not fig for num in plt.get_fignums())  # the figure number is re-used
+
+
+def test_open_figures_do_not_grow_with_visualizers():
+    plt.close('all')
+    open_figures = []
+    mvs = []
+    for i in range(10):
+        mv = MetricVisualizer(name='test{}'.format(i), dump_interval=0)
+        mv.ingest_all(np.random.random((3, 4, 2)), metric_names=['metric1', 'metric2'])
+        for kind in ('traj', 'violin', 'box', 'avg_bar', 'sum_bar'):
+            getattr(mv, '{}_plot_by_trial'.format(kind))()
+            getattr(mv, '{}_plot_by_metric'.format(kind))()
+        mv.plot_grid()
+        mvs.append(mv)
+        open_figures.append(len(plt.get_fignums()))
+    assert open_figures == [0] * 10
+
+    # the cached figure is still returned without re-drawing
+    fig = mvs[0].box_plot_by_trial()
+    assert mvs[0].box_plot_by_trial() is fig
+
+
+@pytest.mark.parametrize('dump_interval', [0, None])
+def test_ingest_all_without_dumping(in_tmp_path, dump_interval):
+    mv = MetricVisualizer(name='test', dump_interval=dump_interval)
+    mv.ingest_all(np.random.random((3, 4, 2)))
+    assert mv.dump_pointer is None
+    assert not list(in_tmp_path.glob('*.mv'))
+
+
+def test_ingest_all_dumps(in_tmp_path):
+    mv = MetricVisualizer(name='test')
+    mv.ingest_all(np.random.random((3, 4, 2)))
+    assert [p.name for p in in_tmp_path.glob('*.mv')] == [mv.dump_pointer]
+
+
+def test_trial_stats_midpoint_iqr_on_old_numpy(monkeypatch):
+    data = np.array([[1., 2., 3., 4.]])
+    assert mv_module._trial_stats(data).iqr.tolist() == [2.0]
+
+    percentile = np.percentile
+
+    def old_percentile(a, q, axis=None, interpolation='linear'):
+        # numpy < 1.22 has no method argument
+        return percentile(a, q, axis=axis, method=interpolation)
+
+    monkeypatch.setattr(mv_module.np, 'percentile', old_percentile)
+    assert mv_module._trial_stats(data).iqr.tolist() == [2.0]
+
+
+def test_pairwise_ranksums_on_old_scipy(monkeypatch):
+    import scipy.stats
+    data = np.random.default_rng(0).random((2, 3, 10))
+    names = ['a', 'b', 'c']
+    results = mv_module._pairwise_ranksums(data, names)
+
+    ranksums = scipy.stats.ranksums
+
+    def old_ranksums(x, y):
+        # ranksums has no axis argument in the older scipy
+        return ranksums(x, y)
+
+    monkeypatch.setattr(scipy.stats, 'ranksums', old_ranksums)
+    old_results = mv_module._pairwise_ranksums(data, names)
+    assert [list(group) for group in old_results] == [list(group) for group in results]
+    for group, old_group in zip(results, old_results):
+        for pair, result in group.items():
+            assert np.allclose(tuple(old_group[pair]), tuple(result))
+
+
+def test_caches_follow_direct_edits():
+    mv = MetricVisualizer(name='test', dump_interval=0)
+    for trial in range(2):
+        mv.add_metrics(['a', 'b'], [[1., 2.], [3., 4.]])
+        mv.next_trial()
+
+    fig = mv.avg_bar_plot_by_trial()
+    mv.metrics['a']['trial0'] = [10., 20.]
+    assert mv.avg_bar_plot_by_trial() is not fig
+    assert mv._compute_summary()[0][2] == [10.0, 20.0]
+
+    mv.metrics['c'] = mv.metrics.pop('b')
+    assert [row[0] for row in mv._compute_summary()] == ['a', 'a', 'c', 'c']
+
+    mv.metrics['a']['trial1'][0] = 5.
+    mv.invalidate()
+    assert mv._compute_summary()[1][3] == ['Avg:4.0, Median: 4.0, IQR: 0.0, STD:1.0, Max: 5.0, Min: 3.0']
+
+
+def test_caches_follow_direct_edits_of_buffer():
+    mv = MetricVisualizer(name='test', dump_interval=0)
+    mv.ingest_all(np.ones((2, 3, 2)), metric_names=['a', 'b'])
+    mv._compute_summary()
+
+    mv.metrics['c'] = mv.metrics.pop('b')
+    mv.metrics['a']['trial0'] = [2., 2., 2.]
+    rows = mv._compute_summary()
+    assert [row[0] for row in rows] == ['a', 'a', 'c', 'c']
+    assert rows[0][3] == ['Avg:2.0, Median: 2.0, IQR: 0.0, STD:0.0, Max: 2.0, Min: 2.0']
+
+
+def test_dump_buffer_once():
+    mv = MetricVisualizer(name='test', dump_interval=0)
+    mv.ingest_all(np.random.random((20, 100, 100)))
+    summary = mv._compute_summary()
+
+    state = mv.__getstate__()
+    assert '_cached_stats' not in state
+    dumped = pickle.dumps(mv, protocol=pickle.HIGHEST_PROTOCOL)
+    assert len(dumped) < 1.2 * mv._buf.nbytes  # the views are not dumped as copies
+
+    loaded = pickle.loads(dumped)
+    assert loaded._compute_summary() == summary
+    loaded._buf[0, 0, 0] = 42
+    assert loaded.metrics['Metric-1']['trial0'][0] == 42  # the metrics are the views of the loaded buffer
+
+
+def test_summary_iqr_and_std():
+    mv = MetricVisualizer(name='test', metric_dict={'metric1': {'trial0': [1., 2., 3., 4.]}}, dump_interval=0)
+    # the midpoint IQR is 3.5 - 1.5 and the std is sqrt(1.25)
+    assert mv._compute_summary()[0][3] == ['Avg:2.5, Median: 2.5, IQR: 2.0, STD:1.12, Max: 4.0, Min: 1.0']
+
+
+def test_ingest_all_replaces_metrics():
+    mv = MetricVisualizer(name='test', dump_interval=0)
+    mv.add_metric('old', 1.)
+    mv.next_trial()
+    mv.ingest_all(np.ones((2, 3, 1)), metric_names=['a'])
+    assert list(mv.metrics) == ['a'] and mv.trial_id == 2
+    assert mv._compute_summary()[0][3] == ['Avg:1.0, Median: 1.0, IQR: 0.0, STD:0.0, Max: 1.0, Min: 1.0']
+
+    mv.ingest_all(np.full((3, 2, 2), 2.), metric_names=['b', 'c'])
+    assert list(mv.metrics) == ['b', 'c'] and mv.trial_id == 3
+    assert [row[0] for row in mv._compute_summary()] == ['b'] * 3 + ['c'] * 3
+    assert mv._compute_summary()[0][2] == [2.0, 2.0]
+
+    with pytest.raises(ValueError):
+        mv.ingest_all(np.ones((2, 3, 2)), metric_names=['d'])
+    assert list(mv.metrics) == ['b', 'c']
+
+
+def test_plot_grid_reports_unequal_trials(capsys):
+    plt.close('all')
+    mv = MetricVisualizer(name='test', metric_dict={'a': {'t0': [1., 2., 3.], 't1': [1., 2.]}}, dump_interval=0)
+    assert mv.plot_grid() is None
+    assert 'Exception' in capsys.readouterr().out
+    assert not plt.get_fignums()
+
+
+@pytest.mark.parametrize('parts', [dict(avg_point=False), dict(avg_point=False, traj_fill=False),
+                                   dict(avg_point=False, traj_fill=False, traj_point=False)])
+def test_traj_plot_without_avg_point(parts):
+    mv = MetricVisualizer(name='test', dump_interval=0)
+    for trial in range(2):
+        mv.add_metrics(['a', 'b'], np.random.random((3, 2)))
+        mv.next_trial()
+
+    fig = mv.traj_plot_by_trial(**parts)
+    legend = fig.axes[0].get_legend()
+    if len(parts) == 3:
+        assert legend is None
+    else:
+        assert [text.get_text() for text in legend.get_texts()] == ['a', 'b']
+
+
+def test_summary_file(in_tmp_path):
+    mv = MetricVisualizer(name='test', metric_dict={'metric1': {'trial0': [1., 2.]}}, dump_interval=0)
+    summary_str = mv.summary(save_path=str(in_tmp_path), no_print=True)
+    assert (in_tmp_path / 'test_summary.txt').read_text(encoding='utf8') == summary_str